@@ -0,0 +1,251 @@
+import bson
+import collections
+import concurrent.futures
+import fnmatch
+import json
+import os
+import re
+import stat
+import tarfile
+import zlib
+
+
+
+# tar.gz archive writer which compresses blocks in parallel, each block
+# is a separate gzip member so that the archive is a regular gzip stream
+class Archiver():
+
+	# size of the blocks which are compressed in parallel
+	BLOCK_SIZE = 4 * 1024 ** 2
+
+	# reports of previous runs, which nextflow renames with a suffix
+	EXCLUDE = re.compile(r'^reports/(report\.html|timeline\.html|trace\.txt)\..+$')
+
+	def __init__(self, max_workers=None, level=6):
+		self._max_workers = max_workers or os.cpu_count()
+		self._level = level
+
+	def index_filename(self, filename):
+		return os.path.join(os.path.dirname(filename), '.%s.index' % os.path.basename(filename))
+
+	def walk(self, src_dir, arcname):
+		# walk directories and files under a directory, following symbolic
+		# links so that linked files are archived in place of the links,
+		# each directory comes before its contents
+		visited = set()
+		stack = ['']
+
+		while stack:
+			relpath = stack.pop()
+			path = os.path.join(src_dir, relpath)
+			st = os.stat(path)
+
+			# skip directories which were already visited through a link
+			if (st.st_dev, st.st_ino) in visited:
+				continue
+
+			visited.add((st.st_dev, st.st_ino))
+			yield os.path.join(arcname, relpath).rstrip('/'), path, st
+
+			with os.scandir(path) as it:
+				for e in it:
+					child = os.path.join(relpath, e.name)
+
+					if self.EXCLUDE.match(child):
+						continue
+
+					try:
+						child_st = os.stat(e.path)
+					except FileNotFoundError:
+						print('warning: skipping broken link %s' % (e.path), flush=True)
+						continue
+
+					if stat.S_ISDIR(child_st.st_mode):
+						stack.append(child)
+					elif stat.S_ISREG(child_st.st_mode):
+						yield os.path.join(arcname, child), e.path, child_st
+
+	def list_files(self, src_dir, arcname):
+		return sorted(self.walk(src_dir, arcname), key=lambda e: e[0])
+
+	def load_index(self, filename):
+		# load the index of a previous archive, if it belongs to that archive
+		try:
+			with open(self.index_filename(filename)) as f:
+				index = json.load(f)
+
+			st = os.stat(filename)
+		except (OSError, ValueError):
+			return {}
+
+		if (index['size'], index['mtime']) != (st.st_size, st.st_mtime_ns):
+			return {}
+
+		return {entry['name']: entry for entry in index['entries']}
+
+	def header(self, name, st):
+		info = tarfile.TarInfo(name)
+		info.mode = st.st_mode & 0o7777
+		info.mtime = int(st.st_mtime)
+
+		if stat.S_ISDIR(st.st_mode):
+			info.type = tarfile.DIRTYPE
+		else:
+			info.size = st.st_size
+
+		return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+	def read_blocks(self, name, path, st):
+		# split the tar entry of a file (header, data and padding) into
+		# blocks, along with whether each block is the last one
+		block = self.header(name, st)
+		remaining = st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+		if remaining == 0:
+			yield block, True
+			return
+
+		with open(path, 'rb') as f:
+			while remaining > 0:
+				data = f.read(min(remaining, self.BLOCK_SIZE))
+
+				if not data:
+					raise OSError('%s changed size while archiving' % (path))
+
+				remaining -= len(data)
+				block += data
+
+				if remaining == 0:
+					block += b'\0' * (-st.st_size % tarfile.BLOCKSIZE)
+
+				yield block, remaining == 0
+				block = b''
+
+	def compress(self, data):
+		# compress a block into a separate gzip member
+		compressor = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+
+		return compressor.compress(data) + compressor.flush()
+
+	def stream(self, src_dir, arcname, pattern=None):
+		# generate an uncompressed tar stream of a directory in blocks,
+		# optionally only the files whose relative path matches a pattern
+		buffer = bytearray()
+
+		for name, path, st in self.walk(src_dir, arcname):
+			if pattern != None and (stat.S_ISDIR(st.st_mode) or not fnmatch.fnmatch(os.path.relpath(name, arcname), pattern)):
+				continue
+
+			for block, _ in self.read_blocks(name, path, st):
+				buffer += block
+
+				if len(buffer) >= self.BLOCK_SIZE:
+					yield bytes(buffer)
+					buffer = bytearray()
+
+		yield bytes(buffer) + b'\0' * 2 * tarfile.BLOCKSIZE
+
+	def create(self, src_dir, filename, arcname, extra=(), progress=None):
+		# list files to archive, extra files are given as (arcname, path)
+		# and replace any files of the same name
+		extra = [(name, path, os.stat(path)) for name, path in extra]
+		extra_names = set(name for name, _, _ in extra)
+		entries = [e for e in self.list_files(src_dir, arcname) if e[0] not in extra_names] + extra
+
+		previous = self.load_index(filename)
+		status = {
+			'files': 0,
+			'bytes': 0,
+			'reused': 0,
+			'total': sum(st.st_size for _, _, st in entries if stat.S_ISREG(st.st_mode))
+		}
+
+		index = []
+		tmp_filename = '%s.%s.tmp' % (filename, bson.ObjectId())
+		previous_archive = open(filename, 'rb') if previous else None
+
+		try:
+			with open(tmp_filename, 'wb') as out, \
+				concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+				pending = collections.deque()
+
+				def write_next():
+					# write the next block, or the range of a previous archive
+					record, block, first, last = pending.popleft()
+
+					if first:
+						record['offset'] = out.tell()
+
+					if isinstance(block, concurrent.futures.Future):
+						data = block.result()
+						out.write(data)
+					else:
+						previous_archive.seek(block[0])
+						remaining = block[1]
+
+						while remaining > 0:
+							data = previous_archive.read(min(remaining, self.BLOCK_SIZE))
+							out.write(data)
+							remaining -= len(data)
+
+					if last:
+						record['length'] = out.tell() - record['offset']
+						status['files'] += 1
+						status['bytes'] += record['size']
+
+						if progress != None:
+							progress(dict(status))
+
+				for name, path, st in entries:
+					record = {
+						'name': name,
+						'source': os.path.realpath(path),
+						'size': st.st_size if stat.S_ISREG(st.st_mode) else 0,
+						'mtime': st.st_mtime_ns
+					}
+					index.append(record)
+
+					# reuse compressed entries of unchanged files from the previous archive
+					prev = previous.get(name)
+
+					if prev != None and record['size'] > 0 and all(prev[k] == record[k] for k in ['source', 'size', 'mtime']):
+						pending.append((record, (prev['offset'], prev['length']), True, True))
+						status['reused'] += record['size']
+
+					# otherwise compress the entry in blocks, keeping a bounded
+					# number of blocks in memory
+					else:
+						first = True
+
+						for block, last in self.read_blocks(name, path, st):
+							pending.append((record, executor.submit(self.compress, block), first, last))
+							first = False
+
+							while len(pending) > 2 * self._max_workers:
+								write_next()
+
+				while pending:
+					write_next()
+
+				# write end-of-archive marker
+				out.write(self.compress(b'\0' * 2 * tarfile.BLOCKSIZE))
+
+			# write index, then move archive and index into place
+			st = os.stat(tmp_filename)
+			tmp_index_filename = '%s.%s.tmp' % (self.index_filename(filename), bson.ObjectId())
+
+			with open(tmp_index_filename, 'w') as f:
+				json.dump({ 'size': st.st_size, 'mtime': st.st_mtime_ns, 'entries': index }, f)
+
+			os.replace(tmp_filename, filename)
+			os.replace(tmp_index_filename, self.index_filename(filename))
+		except:
+			if os.path.exists(tmp_filename):
+				os.remove(tmp_filename)
+
+			raise
+		finally:
+			if previous_archive != None:
+				previous_archive.close()
+
+		return status
@@ -1,7 +1,28 @@
+import asyncio
+import bisect
+import concurrent.futures
+import copy
+import fcntl
+import json
+import mmap
 import motor.motor_tornado
-import multiprocessing as mp
+import os
 import pickle
 import pymongo
+import pymongo.errors
+import sqlite3
+import struct
+import threading
+
+
+
+class TaskCreateError(Exception):
+
+	# raised when some tasks of a batch could not be saved, tasks
+	# which already exist are not errors, so a batch can be retried
+	def __init__(self, message, tasks):
+		super().__init__(message)
+		self.tasks = tasks
 
 
 
@@ -12,7 +33,14 @@ class Backend():
 	def initialize(self):
 		pass
 
-	async def workflow_query(self, page, page_size):
+	async def prepare(self):
+		pass
+
+	async def workflow_query(self, page, page_size, after=None):
+		raise NotImplementedError()
+
+	async def workflow_query_status(self, status):
+		# all workflows with the given status, in no particular order
 		raise NotImplementedError()
 
 	async def workflow_create(self, workflow):
@@ -24,220 +52,1056 @@ class Backend():
 	async def workflow_update(self, id, workflow):
 		raise NotImplementedError()
 
+	async def workflow_update_fields(self, id, fields):
+		# update only the given fields of a workflow
+		raise NotImplementedError()
+
 	async def workflow_delete(self, id):
 		raise NotImplementedError()
 
-	async def task_query(self, page, page_size):
+	async def task_query(self, page, page_size, after=None):
+		raise NotImplementedError()
+
+	async def task_query_pipelines(self):
+		raise NotImplementedError()
+
+	def task_query_pipeline(self, pipeline, processes=None, by_process=False):
+		# async iterator over the completed tasks of a pipeline, optionally
+		# only the tasks of the given processes or ordered by process
 		raise NotImplementedError()
 
 	async def task_create(self, task):
 		raise NotImplementedError()
 
+	async def task_create_many(self, tasks):
+		for task in tasks:
+			await self.task_create(task)
+
 	async def task_get(self, id):
 		raise NotImplementedError()
 
+	async def pipeline_query(self):
+		raise NotImplementedError()
+
+	async def pipeline_rebuild(self):
+		raise NotImplementedError()
+
+	async def pipeline_of_run(self, run_id):
+		raise NotImplementedError()
+
+
+
+class FileLock():
+
+	# lock which is exclusive across threads and processes, the lock file is
+	# re-opened after a fork since flock() locks are shared by inherited files
+	def __init__(self, url):
+		self._url = url
+		self._pid = None
+
+	def reset(self):
+		self._thread_lock = threading.Lock()
+		self._file = open(self._url, 'a')
+		self._pid = os.getpid()
+
+	def __enter__(self):
+		if self._pid != os.getpid():
+			self.reset()
+
+		self._thread_lock.acquire()
+
+		try:
+			fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+		except:
+			self._thread_lock.release()
+			raise
+
+	def __exit__(self, *args):
+		fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+		self._thread_lock.release()
+
+
+
+class Generation():
+
+	# counters in a memory-mapped file, the generation is incremented on
+	# every change to the database and the epoch on every compaction, so
+	# that other processes can check for changes without touching the journal
+	COUNTERS = struct.Struct('<QQ')
+
+	def __init__(self, url):
+		with open(url, 'a+b') as f:
+			if os.fstat(f.fileno()).st_size < self.COUNTERS.size:
+				f.truncate(self.COUNTERS.size)
+
+			self._mmap = mmap.mmap(f.fileno(), self.COUNTERS.size)
+
+	def get(self):
+		return self.COUNTERS.unpack_from(self._mmap, 0)
+
+	def increment(self, compacted=False):
+		generation, epoch = self.get()
+		generation, epoch = generation + 1, epoch + int(compacted)
+
+		self.COUNTERS.pack_into(self._mmap, 0, generation, epoch)
+
+		return generation, epoch
+
 
 
 class FileBackend(Backend):
 
+	# compact the journal once it is larger than this or the snapshot
+	JOURNAL_MIN_SIZE = 16 * 1024 ** 2
+
+	# header of each journal record (length of the pickled record)
+	RECORD_HEADER = struct.Struct('<Q')
+
+	# secondary keys which are indexed for each collection
+	INDEX_KEYS = {
+		'workflows': [],
+		'tasks': ['runId', 'runName', 'event']
+	}
+
+	# timestamp key by which each collection is sorted
+	SORT_KEYS = {
+		'workflows': 'date_created',
+		'tasks': 'utcTime'
+	}
+
 	def __init__(self, url):
-		self._lock = mp.Lock()
+		self._lock = FileLock('%s.lock' % (url))
 		self._url = url
+		self._journal_url = '%s.journal' % (url)
+		self._journal = None
+		self._compactor = None
 		self.initialize()
 
-	def initialize(self, error_not_found=False):
-		# load database from pickle file
-		try:
+	def initialize(self):
+		with self._lock:
+			self._generation = Generation('%s.gen' % (self._url))
 			self.load()
 
+	def load(self):
+		# load snapshot from pickle file
+		try:
+			with open(self._url, 'rb') as f:
+				db = pickle.load(f)
+				self._snapshot_size = os.fstat(f.fileno()).st_size
+
 		# initialize empty database if pickle file doesn't exist
 		except FileNotFoundError:
-			self._db = {
+			db = {
 				'workflows': [],
 				'tasks': []
 			}
-			self.save()
+			self._snapshot_size = 0
 
-	def load(self):
-		self._db = pickle.load(open(self._url, 'rb'))
+		# index records by id, secondary keys and timestamp
+		self._db = {}
+		self._index = {}
+		self._order = {}
 
-	def save(self):
-		pickle.dump(self._db, open(self._url, 'wb'))
+		# maintain pipeline catalog from task events
+		self._catalog = {}
+		self._run_pipelines = {}
 
-	async def workflow_query(self, page, page_size):
-		self._lock.acquire()
-		self.load()
+		for collection, keys in self.INDEX_KEYS.items():
+			self._db[collection] = {}
+			self._index[collection] = {key: {} for key in keys}
+			self._order[collection] = []
 
-		# sort workflows by date_created in descending order
-		self._db['workflows'].sort(key=lambda w: w['date_created'], reverse=True)
+			for record in db[collection]:
+				self.apply('create', collection, record)
 
-		# return the specified page of workflows
-		workflows = self._db['workflows'][(page * page_size) : ((page + 1) * page_size)]
+		self._seq = db.get('seq', 0)
 
-		self._lock.release()
+		# replay journal records which are newer than the snapshot
+		self.open_journal()
+		self.replay()
+		self._generation_seen, self._epoch = self._generation.get()
 
-		return workflows
+	def open_journal(self):
+		if self._journal != None:
+			self._journal.close()
 
-	async def workflow_create(self, workflow):
-		self._lock.acquire()
-		self.load()
+		self._journal = open(self._journal_url, 'ab', buffering=0)
+		self._journal_offset = 0
 
-		# append workflow to list of workflows
-		self._db['workflows'].append(workflow)
+	def replay(self):
+		offset = self._journal_offset
 
-		self.save()
-		self._lock.release()
+		with open(self._journal_url, 'rb') as f:
+			f.seek(offset)
 
-	async def workflow_get(self, id):
-		self._lock.acquire()
-		self.load()
+			while True:
+				# read the next complete record
+				header = f.read(self.RECORD_HEADER.size)
+				if len(header) < self.RECORD_HEADER.size:
+					break
+
+				size, = self.RECORD_HEADER.unpack(header)
+				data = f.read(size)
+				if len(data) < size:
+					break
+
+				# apply record unless it is already part of the snapshot
+				seq, op, collection, record = pickle.loads(data)
+
+				if seq > self._seq:
+					self.apply(op, collection, record)
+					self._seq = seq
+
+				offset += len(header) + size
 
-		# search for workflow by id
-		workflow = None
+			# discard an incomplete record left behind by an interrupted write
+			f.seek(0, os.SEEK_END)
+			if f.tell() > offset:
+				os.ftruncate(self._journal.fileno(), offset)
 
-		for w in self._db['workflows']:
-			if w['_id'] == id:
-				workflow = w
-				break
+		self._journal_offset = offset
 
-		self._lock.release()
+	def sync(self):
+		# skip sync if no other process has changed the database
+		generation, epoch = self._generation.get()
+
+		if generation == self._generation_seen:
+			return
+
+		# reload database if the journal was compacted by another process
+		if epoch != self._epoch:
+			self.load()
+
+		# otherwise replay any records appended by another process
+		else:
+			self.replay()
+			self._generation_seen = generation
+
+	def apply(self, op, collection, record):
+		records = self._db[collection]
+		index = self._index[collection]
+		order = self._order[collection]
+		sort_key = self.SORT_KEYS[collection]
+		id = record['_id']
+
+		# remove previous version of record from indexes
+		prev = records.pop(id, None)
+
+		if prev != None:
+			for key, values in index.items():
+				ids = values.get(prev.get(key))
+
+				if ids != None:
+					ids.pop(id, None)
+
+			i = bisect.bisect_left(order, (prev[sort_key], id))
+			if i < len(order) and order[i] == (prev[sort_key], id):
+				order.pop(i)
+
+		# insert new version of record
+		if op in ['create', 'update']:
+			records[id] = record
+
+			for key, values in index.items():
+				if record.get(key) != None:
+					values.setdefault(record[key], {})[id] = None
+
+			bisect.insort(order, (record[sort_key], id))
+
+			if collection == 'tasks' and prev == None:
+				self.catalog_apply(record)
+
+	def catalog_apply(self, task):
+		# add run to catalog on 'started' event, a resumed run has
+		# a 'started' event for each attempt under the same run id
+		if task['event'] == 'started':
+			pipeline = task['metadata']['workflow']['projectName']
+			entry = self._catalog.setdefault(pipeline, {
+				'pipeline': pipeline,
+				'runs': 0,
+				'last_run': None,
+				'processes': {}
+			})
+
+			if task['runId'] not in self._run_pipelines:
+				entry['runs'] += 1
+
+			entry['last_run'] = max(entry['last_run'] or '', task['utcTime'])
+			self._run_pipelines[task['runId']] = pipeline
+
+		# add process to catalog on 'process_completed' event
+		elif task['event'] == 'process_completed':
+			pipeline = self._run_pipelines.get(task['runId'])
+
+			if pipeline != None:
+				self._catalog[pipeline]['processes'][task['trace']['process']] = None
+
+	def lookup(self, collection, key, value):
+		# return the records whose key matches the given value
+		records = self._db[collection]
+		ids = self._index[collection][key].get(value, {})
+
+		return [records[id] for id in ids]
+
+	def page(self, collection, page, page_size, after=None):
+		# return the specified page of records in descending timestamp order
+		records = self._db[collection]
+		order = self._order[collection]
+
+		# start after the given (timestamp, id) cursor if specified
+		if after != None:
+			end = bisect.bisect_left(order, tuple(after))
+		else:
+			end = max(0, len(order) - page * page_size)
+
+		start = max(0, end - page_size)
+
+		return [records[id] for _, id in reversed(order[start:end])]
+
+	def write(self, op, collection, record):
+		self.write_many(op, collection, [record])
+
+	def write_many(self, op, collection, records):
+		# append records to journal in a single write
+		chunks = []
+
+		for record in records:
+			self._seq += 1
+
+			data = pickle.dumps((self._seq, op, collection, record), protocol=pickle.HIGHEST_PROTOCOL)
+			chunks.append(self.RECORD_HEADER.pack(len(data)))
+			chunks.append(data)
+
+		data = b''.join(chunks)
+
+		self._journal.write(data)
+		self._journal_offset += len(data)
+		self._generation_seen, _ = self._generation.increment()
+
+		# apply records to in-memory database
+		for record in records:
+			self.apply(op, collection, record)
+
+		# start compaction in the background if the journal is too large
+		if self._journal_offset > max(self.JOURNAL_MIN_SIZE, self._snapshot_size):
+			self.compact_async()
+
+	def compact_async(self):
+		if self._compactor != None and self._compactor.is_alive():
+			return
+
+		# records are never modified in place, so a shallow copy of
+		# the database is a consistent snapshot, saved in timestamp order
+		# so that it can be re-indexed quickly
+		snapshot = {
+			collection: [records[id] for _, id in self._order[collection]]
+			for collection, records in self._db.items()
+		}
+		snapshot['seq'] = self._seq
+
+		self._compactor = threading.Thread(
+			target=self.compact,
+			args=(snapshot, self._epoch, self._journal_offset),
+			daemon=True)
+		self._compactor.start()
+
+	def compact(self, snapshot, epoch, journal_offset):
+		# write snapshot to a temporary file without holding the lock
+		snapshot_url = '%s.%d.tmp' % (self._url, os.getpid())
+
+		with open(snapshot_url, 'wb') as f:
+			pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+			f.flush()
+			os.fsync(f.fileno())
+
+		with self._lock:
+			self.sync()
+
+			# discard snapshot if the journal was compacted by another process
+			if self._epoch != epoch:
+				os.remove(snapshot_url)
+				return
+
+			# move records which were appended in the meantime to a new journal
+			journal_url = '%s.%d.tmp' % (self._journal_url, os.getpid())
+
+			with open(self._journal_url, 'rb') as f:
+				f.seek(journal_offset)
+				tail = f.read()
+
+			with open(journal_url, 'wb') as f:
+				f.write(tail)
+				f.flush()
+				os.fsync(f.fileno())
+
+			# replace snapshot and journal
+			os.replace(snapshot_url, self._url)
+			os.replace(journal_url, self._journal_url)
+
+			self._snapshot_size = os.stat(self._url).st_size
+			self.open_journal()
+			self._journal_offset = len(tail)
+			self._generation_seen, self._epoch = self._generation.increment(compacted=True)
+
+	async def workflow_query(self, page, page_size, after=None):
+		with self._lock:
+			self.sync()
+
+			# return the specified page of workflows by date_created in descending order
+			workflows = self.page('workflows', page, page_size, after)
+
+		return copy.deepcopy(workflows)
+
+	async def workflow_query_status(self, status):
+		with self._lock:
+			self.sync()
+
+			workflows = [w for w in self._db['workflows'].values() if w.get('status') == status]
+
+		return copy.deepcopy(workflows)
+
+	async def workflow_create(self, workflow):
+		with self._lock:
+			self.sync()
+
+			# append workflow to list of workflows
+			self.write('create', 'workflows', copy.deepcopy(workflow))
+
+	async def workflow_get(self, id):
+		with self._lock:
+			self.sync()
+
+			# search for workflow by id
+			workflow = self._db['workflows'].get(id)
 
 		# return workflow or raise error if workflow wasn't found
 		if workflow != None:
-			return workflow
+			return copy.deepcopy(workflow)
 		else:
 			raise IndexError('Workflow was not found')
 
 	async def workflow_update(self, id, workflow):
-		self._lock.acquire()
-		self.load()
+		with self._lock:
+			self.sync()
 
-		# search for workflow by id and update it
-		found = False
+			# search for workflow by id and update it
+			found = id in self._db['workflows']
 
-		for i, w in enumerate(self._db['workflows']):
-			if w['_id'] == id:
-				# update workflow
-				self._db['workflows'][i] = workflow
-				found = True
-				break
-
-		self.save()
-		self._lock.release()
+			if found:
+				self.write('update', 'workflows', {**copy.deepcopy(workflow), '_id': id})
 
 		# raise error if workflow wasn't found
 		if not found:
 			raise IndexError('Workflow was not found')
 
-	async def workflow_delete(self, id):
-		self._lock.acquire()
-		self.load()
+	async def workflow_update_fields(self, id, fields):
+		with self._lock:
+			self.sync()
 
-		# search for workflow by id and delete it
-		found = False
+			# search for workflow by id and update the given fields
+			workflow = self._db['workflows'].get(id)
 
-		for i, w in enumerate(self._db['workflows']):
-			if w['_id'] == id:
-				# delete workflow
-				self._db['workflows'].pop(i)
-				found = True
-				break
-
-		self.save()
-		self._lock.release()
+			if workflow != None:
+				self.write('update', 'workflows', {**workflow, **copy.deepcopy(fields), '_id': id})
 
 		# raise error if workflow wasn't found
-		if not found:
+		if workflow == None:
 			raise IndexError('Workflow was not found')
 
-	async def task_query(self, page, page_size):
-		self._lock.acquire()
-		self.load()
+	async def workflow_delete(self, id):
+		with self._lock:
+			self.sync()
+
+			# search for workflow by id and delete it
+			found = id in self._db['workflows']
+
+			if found:
+				self.write('delete', 'workflows', { '_id': id })
 
-		# sort tasks by date_created in descending order
-		self._db['tasks'].sort(key=lambda t: t['utcTime'], reverse=True)
+		# raise error if workflow wasn't found
+		if not found:
+			raise IndexError('Workflow was not found')
 
-		# return the specified page of workflows
-		tasks = self._db['tasks'][(page * page_size) : ((page + 1) * page_size)]
+	async def task_query(self, page, page_size, after=None):
+		with self._lock:
+			self.sync()
 
-		self._lock.release()
+			# return the specified page of tasks by utcTime in descending order
+			tasks = self.page('tasks', page, page_size, after)
 
 		return tasks
 
 	async def task_query_pipelines(self):
-		self._lock.acquire()
-		self.load()
-
-		# extract list of unique pipelines from all 'started' events
-		pipelines = [t['metadata']['workflow']['projectName'] for t in self._db['tasks'] if t['event'] == 'started']
-		pipelines = list(set(pipelines))
+		pipelines = await self.pipeline_query()
 
-		self._lock.release()
+		return [p['pipeline'] for p in pipelines]
 
-		return pipelines
+	async def task_query_pipeline(self, pipeline, processes=None, by_process=False):
+		with self._lock:
+			self.sync()
 
-	async def task_query_pipeline(self, pipeline):
-		self._lock.acquire()
-		self.load()
+			# find all runs of the given pipeline
+			run_ids = dict.fromkeys([t['runId'] for t in self.lookup('tasks', 'event', 'started') if t['metadata']['workflow']['projectName'] == pipeline])
 
-		# find all runs of the given pipeline
-		run_ids = [t['runId'] for t in self._db['tasks'] if t['event'] == 'started' and t['metadata']['workflow']['projectName'] == pipeline]
+			# find all tasks associated with the given runs
+			tasks = [t for run_id in run_ids for t in self.lookup('tasks', 'runId', run_id) if t['event'] == 'process_completed']
 
-		# find all tasks associated with the given runs
-		tasks = [t for t in self._db['tasks'] if t['event'] == 'process_completed' and t['runId'] in run_ids]
+			if processes != None:
+				tasks = [t for t in tasks if t['trace']['process'] in processes]
 
-		self._lock.release()
+		if by_process:
+			tasks.sort(key=lambda t: t['trace']['process'])
 
-		return tasks
+		for task in tasks:
+			yield task
 
 	async def task_create(self, task):
-		self._lock.acquire()
-		self.load()
+		await self.task_create_many([task])
 
-		# append workflow to list of workflows
-		self._db['tasks'].append(task)
+	async def task_create_many(self, tasks):
+		with self._lock:
+			self.sync()
 
-		self.save()
-		self._lock.release()
+			# append tasks to list of tasks, skipping tasks which already exist
+			ids = set()
+			new_tasks = []
 
-	async def task_get(self, id):
-		self._lock.acquire()
-		self.load()
+			for task in tasks:
+				if task['_id'] not in self._db['tasks'] and task['_id'] not in ids:
+					ids.add(task['_id'])
+					new_tasks.append(task)
 
-		# search for task by id
-		task = None
+			if new_tasks:
+				self.write_many('create', 'tasks', copy.deepcopy(new_tasks))
 
-		for t in self._db['tasks']:
-			if t['_id'] == id:
-				task = t
-				break
+	async def task_get(self, id):
+		with self._lock:
+			self.sync()
 
-		self._lock.release()
+			# search for task by id
+			task = self._db['tasks'].get(id)
 
 		# raise error if task wasn't found
 		if task != None:
-			return task
+			return copy.deepcopy(task)
 		else:
 			raise IndexError('Task was not found')
 
+	async def pipeline_query(self):
+		with self._lock:
+			self.sync()
+
+			pipelines = [{**p, 'processes': list(p['processes'].keys())} for p in self._catalog.values()]
+
+		return pipelines
+
+	async def pipeline_rebuild(self):
+		with self._lock:
+			self.sync()
+
+			# rebuild pipeline catalog from all tasks in timestamp order
+			self._catalog = {}
+			self._run_pipelines = {}
+
+			for _, id in self._order['tasks']:
+				self.catalog_apply(self._db['tasks'][id])
+
+	async def pipeline_of_run(self, run_id):
+		with self._lock:
+			self.sync()
+
+			return self._run_pipelines.get(run_id)
+
+
+
+class SQLiteBackend(Backend):
+
+	SCHEMA = [
+		'''CREATE TABLE IF NOT EXISTS workflows (
+			_id TEXT PRIMARY KEY,
+			date_created INTEGER,
+			data TEXT NOT NULL
+		)''',
+		'''CREATE TABLE IF NOT EXISTS tasks (
+			_id TEXT PRIMARY KEY,
+			utcTime TEXT,
+			event TEXT,
+			runId TEXT,
+			runName TEXT,
+			projectName TEXT,
+			data TEXT NOT NULL,
+			trace TEXT
+		)''',
+		'CREATE INDEX IF NOT EXISTS workflows_date_created_id ON workflows (date_created, _id)',
+		'CREATE INDEX IF NOT EXISTS workflows_status ON workflows (json_extract(data, \'$.status\'))',
+		'CREATE INDEX IF NOT EXISTS tasks_utcTime_id ON tasks (utcTime, _id)',
+		'CREATE INDEX IF NOT EXISTS tasks_event_projectName ON tasks (event, projectName)',
+		'CREATE INDEX IF NOT EXISTS tasks_event_runId ON tasks (event, runId)',
+		'CREATE INDEX IF NOT EXISTS tasks_runName ON tasks (runName)',
+		'''CREATE TABLE IF NOT EXISTS pipelines (
+			projectName TEXT PRIMARY KEY,
+			runs INTEGER NOT NULL,
+			last_run TEXT
+		)''',
+		'''CREATE TABLE IF NOT EXISTS pipeline_processes (
+			projectName TEXT,
+			process TEXT,
+			PRIMARY KEY (projectName, process)
+		)'''
+	]
+
+	def __init__(self, url, max_workers=4):
+		self._url = url
+		self._max_workers = max_workers
+		self.initialize()
+
+	def initialize(self):
+		# create a new thread pool, since threads do not survive a fork
+		self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers)
+		self._local = threading.local()
+
+		# create tables and indexes
+		conn = self.connect()
+
+		with conn:
+			for statement in self.SCHEMA:
+				conn.execute(statement)
+
+		# build pipeline catalog if it is missing from an existing database
+		catalog_empty = conn.execute('SELECT COUNT(*) FROM pipelines').fetchone()[0] == 0
+		tasks_empty = conn.execute('SELECT COUNT(*) FROM tasks WHERE event = \'started\'').fetchone()[0] == 0
+
+		if catalog_empty and not tasks_empty:
+			self._pipeline_rebuild()
+
+	def connect(self):
+		# each worker thread uses its own connection
+		conn = getattr(self._local, 'conn', None)
+
+		if conn == None:
+			conn = sqlite3.connect(self._url, timeout=60)
+			conn.execute('PRAGMA journal_mode=WAL')
+			conn.execute('PRAGMA synchronous=NORMAL')
+			self._local.conn = conn
+
+		return conn
+
+	async def run(self, fn, *args):
+		# run a database call on the thread pool
+		loop = asyncio.get_event_loop()
+
+		return await loop.run_in_executor(self._executor, fn, *args)
+
+	def encode_task(self, task):
+		data = {k: v for k, v in task.items() if k != 'trace'}
+		trace = json.dumps(task['trace']) if 'trace' in task else None
+		project_name = task.get('metadata', {}).get('workflow', {}).get('projectName')
+
+		return (
+			task['_id'],
+			task.get('utcTime'),
+			task.get('event'),
+			task.get('runId'),
+			task.get('runName'),
+			project_name,
+			json.dumps(data),
+			trace
+		)
+
+	def decode_task(self, data, trace):
+		task = json.loads(data)
+
+		if trace != None:
+			task['trace'] = json.loads(trace)
+
+		return task
+
+	def _workflow_query(self, page, page_size, after):
+		# use cursor instead of offset if specified
+		if after != None:
+			rows = self.connect().execute(
+				'SELECT data FROM workflows WHERE (date_created, _id) < (?, ?) ORDER BY date_created DESC, _id DESC LIMIT ?',
+				(*after, page_size)).fetchall()
+		else:
+			rows = self.connect().execute(
+				'SELECT data FROM workflows ORDER BY date_created DESC, _id DESC LIMIT ? OFFSET ?',
+				(page_size, page * page_size)).fetchall()
+
+		return [json.loads(data) for data, in rows]
+
+	async def workflow_query(self, page, page_size, after=None):
+		return await self.run(self._workflow_query, page, page_size, after)
+
+	def _workflow_query_status(self, status):
+		rows = self.connect().execute(
+			'SELECT data FROM workflows WHERE json_extract(data, \'$.status\') = ?',
+			(status,)).fetchall()
+
+		return [json.loads(data) for data, in rows]
+
+	async def workflow_query_status(self, status):
+		return await self.run(self._workflow_query_status, status)
+
+	def _workflow_create(self, workflow):
+		conn = self.connect()
+
+		with conn:
+			conn.execute(
+				'INSERT INTO workflows (_id, date_created, data) VALUES (?, ?, ?)',
+				(workflow['_id'], workflow.get('date_created'), json.dumps(workflow)))
+
+	async def workflow_create(self, workflow):
+		return await self.run(self._workflow_create, workflow)
+
+	def _workflow_get(self, id):
+		row = self.connect().execute('SELECT data FROM workflows WHERE _id = ?', (id,)).fetchone()
+
+		# return workflow or raise error if workflow wasn't found
+		if row != None:
+			return json.loads(row[0])
+		else:
+			raise IndexError('Workflow was not found')
+
+	async def workflow_get(self, id):
+		return await self.run(self._workflow_get, id)
+
+	def _workflow_update(self, id, workflow):
+		conn = self.connect()
+
+		with conn:
+			cursor = conn.execute(
+				'UPDATE workflows SET date_created = ?, data = ? WHERE _id = ?',
+				(workflow.get('date_created'), json.dumps({**workflow, '_id': id}), id))
+
+		# raise error if workflow wasn't found
+		if cursor.rowcount == 0:
+			raise IndexError('Workflow was not found')
+
+	async def workflow_update(self, id, workflow):
+		return await self.run(self._workflow_update, id, workflow)
+
+	def _workflow_update_fields(self, id, fields):
+		# set each field in a single statement
+		paths = ', '.join('?, json(?)' for _ in fields)
+		args = [arg for key, value in fields.items() for arg in ['$."%s"' % (key), json.dumps(value)]]
+
+		conn = self.connect()
+
+		with conn:
+			cursor = conn.execute(
+				'UPDATE workflows SET data = json_set(data, %s) WHERE _id = ?' % (paths),
+				(*args, id))
+
+		# raise error if workflow wasn't found
+		if cursor.rowcount == 0:
+			raise IndexError('Workflow was not found')
+
+	async def workflow_update_fields(self, id, fields):
+		return await self.run(self._workflow_update_fields, id, fields)
+
+	def _workflow_delete(self, id):
+		conn = self.connect()
+
+		with conn:
+			cursor = conn.execute('DELETE FROM workflows WHERE _id = ?', (id,))
+
+		# raise error if workflow wasn't found
+		if cursor.rowcount == 0:
+			raise IndexError('Workflow was not found')
+
+	async def workflow_delete(self, id):
+		return await self.run(self._workflow_delete, id)
+
+	def _task_query(self, page, page_size, after):
+		# use cursor instead of offset if specified
+		if after != None:
+			rows = self.connect().execute(
+				'SELECT _id, runName, utcTime, event FROM tasks WHERE (utcTime, _id) < (?, ?) ORDER BY utcTime DESC, _id DESC LIMIT ?',
+				(*after, page_size)).fetchall()
+		else:
+			rows = self.connect().execute(
+				'SELECT _id, runName, utcTime, event FROM tasks ORDER BY utcTime DESC, _id DESC LIMIT ? OFFSET ?',
+				(page_size, page * page_size)).fetchall()
+
+		return [{'_id': id, 'runName': run_name, 'utcTime': utc_time, 'event': event} for id, run_name, utc_time, event in rows]
+
+	async def task_query(self, page, page_size, after=None):
+		return await self.run(self._task_query, page, page_size, after)
+
+	def _task_query_pipelines(self):
+		rows = self.connect().execute('SELECT projectName FROM pipelines').fetchall()
+
+		return [project_name for project_name, in rows]
+
+	async def task_query_pipelines(self):
+		return await self.run(self._task_query_pipelines)
+
+	def _task_query_pipeline(self, pipeline, processes=None, by_process=False):
+		# use a separate connection, since the cursor is read from several threads
+		conn = sqlite3.connect(self._url, timeout=60, check_same_thread=False)
+
+		# find all tasks associated with runs of the given pipeline
+		query = '''SELECT data, trace FROM tasks
+			WHERE event = 'process_completed' AND runId IN (
+				SELECT runId FROM tasks WHERE event = 'started' AND projectName = ?
+			)'''
+		args = [pipeline]
+
+		if processes != None:
+			query += ' AND json_extract(trace, \'$.process\') IN (%s)' % (', '.join('?' * len(processes)))
+			args += processes
+
+		if by_process:
+			query += ' ORDER BY json_extract(trace, \'$.process\')'
+
+		cursor = conn.execute(query, args)
+
+		return conn, cursor
+
+	async def task_query_pipeline(self, pipeline, processes=None, by_process=False, batch_size=1000):
+		conn, cursor = await self.run(self._task_query_pipeline, pipeline, processes, by_process)
+
+		try:
+			while True:
+				rows = await self.run(cursor.fetchmany, batch_size)
+
+				if not rows:
+					break
+
+				for data, trace in rows:
+					yield self.decode_task(data, trace)
+		finally:
+			await self.run(conn.close)
+
+	def catalog_apply(self, conn, task):
+		# add run to catalog on 'started' event, a resumed run has
+		# a 'started' event for each attempt under the same run id
+		if task['event'] == 'started':
+			pipeline = task['metadata']['workflow']['projectName']
+			resumed = conn.execute(
+				'SELECT 1 FROM tasks WHERE event = \'started\' AND runId = ? AND _id != ? LIMIT 1',
+				(task['runId'], task['_id'])).fetchone() != None
+
+			conn.execute('INSERT OR IGNORE INTO pipelines VALUES (?, 0, NULL)', (pipeline,))
+			conn.execute(
+				'UPDATE pipelines SET runs = runs + ?, last_run = MAX(IFNULL(last_run, \'\'), ?) WHERE projectName = ?',
+				(0 if resumed else 1, task['utcTime'], pipeline))
+
+		# add process to catalog on 'process_completed' event
+		elif task['event'] == 'process_completed':
+			conn.execute(
+				'''INSERT OR IGNORE INTO pipeline_processes
+				SELECT projectName, ? FROM tasks WHERE event = 'started' AND runId = ?''',
+				(task['trace']['process'], task['runId']))
+
+	async def task_create(self, task):
+		return await self.run(self._task_create_many, [task])
+
+	def _task_create_many(self, tasks):
+		conn = self.connect()
+
+		# skip tasks which already exist, and only
+		# add the inserted tasks to the catalog
+		with conn:
+			for task in tasks:
+				cursor = conn.execute('INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.encode_task(task))
+
+				if cursor.rowcount > 0:
+					self.catalog_apply(conn, task)
+
+	async def task_create_many(self, tasks):
+		return await self.run(self._task_create_many, tasks)
+
+	def _task_get(self, id):
+		row = self.connect().execute('SELECT data, trace FROM tasks WHERE _id = ?', (id,)).fetchone()
+
+		# return task or raise error if task wasn't found
+		if row != None:
+			return self.decode_task(*row)
+		else:
+			raise IndexError('Task was not found')
+
+	async def task_get(self, id):
+		return await self.run(self._task_get, id)
+
+	def _pipeline_query(self):
+		conn = self.connect()
+		pipelines = conn.execute('SELECT projectName, runs, last_run FROM pipelines').fetchall()
+		processes = conn.execute('SELECT projectName, process FROM pipeline_processes').fetchall()
+
+		pipelines = {pipeline: {
+			'pipeline': pipeline,
+			'runs': runs,
+			'last_run': last_run,
+			'processes': []
+		} for pipeline, runs, last_run in pipelines}
+
+		for pipeline, process in processes:
+			if pipeline in pipelines:
+				pipelines[pipeline]['processes'].append(process)
+
+		return list(pipelines.values())
+
+	async def pipeline_query(self):
+		return await self.run(self._pipeline_query)
+
+	def _pipeline_rebuild(self):
+		conn = self.connect()
+
+		with conn:
+			conn.execute('DELETE FROM pipelines')
+			conn.execute('DELETE FROM pipeline_processes')
+			conn.execute(
+				'''INSERT INTO pipelines
+				SELECT projectName, COUNT(DISTINCT runId), MAX(utcTime) FROM tasks
+				WHERE event = 'started'
+				GROUP BY projectName''')
+			conn.execute(
+				"""INSERT OR IGNORE INTO pipeline_processes
+				SELECT DISTINCT r.projectName, json_extract(t.trace, '$.process')
+				FROM tasks r JOIN tasks t ON t.runId = r.runId
+				WHERE r.event = 'started' AND t.event = 'process_completed'""")
+
+	async def pipeline_rebuild(self):
+		return await self.run(self._pipeline_rebuild)
+
+	def _pipeline_of_run(self, run_id):
+		row = self.connect().execute(
+			'SELECT projectName FROM tasks WHERE event = \'started\' AND runId = ?',
+			(run_id,)).fetchone()
+
+		return row[0] if row != None else None
+
+	async def pipeline_of_run(self, run_id):
+		return await self.run(self._pipeline_of_run, run_id)
+
 
 
 class MongoBackend(Backend):
-	def __init__(self, url):
+
+	# indexes which are required by the queries below
+	INDEXES = {
+		'workflows': [
+			[('date_created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+			[('status', pymongo.ASCENDING)]
+		],
+		'tasks': [
+			[('utcTime', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+			[('event', pymongo.ASCENDING), ('metadata.workflow.projectName', pymongo.ASCENDING)],
+			[('runId', pymongo.ASCENDING), ('event', pymongo.ASCENDING)]
+		]
+	}
+
+	def __init__(self, url, debug=False):
 		self._url = url
+		self._debug = debug
 		self.initialize()
 
 	def initialize(self):
 		self._client = motor.motor_tornado.MotorClient(self._url)
 		self._db = self._client['nextflow_api']
 
-	async def workflow_query(self, page, page_size):
+		# cache run pipelines and known processes for catalog updates
+		self._run_pipelines = {}
+		self._pipeline_processes = set()
+
+	async def prepare(self):
+		await self.create_indexes()
+
+		# build pipeline catalog if it is missing from an existing database
+		catalog_empty = await self._db.pipelines.find_one() == None
+		tasks_empty = await self._db.tasks.find_one({ 'event': 'started' }) == None
+
+		if catalog_empty and not tasks_empty:
+			await self.pipeline_rebuild()
+
+		if self._debug:
+			await self.explain_queries()
+
+	async def create_indexes(self):
+		for collection, indexes in self.INDEXES.items():
+			# create indexes if they don't exist
+			for keys in indexes:
+				await self._db[collection].create_index(keys)
+
+			# verify that all indexes exist
+			info = await self._db[collection].index_information()
+			existing = [[tuple(k) for k in index['key']] for index in info.values()]
+
+			for keys in indexes:
+				if keys not in existing:
+					print('warning: index %s on %s is missing' % (keys, collection), flush=True)
+
+	def query_shapes(self):
+		# representative explain command for each query shape
+		return {
+			'workflow_query': self._db.workflows \
+				.find(self.page_filter('date_created', (0, ''))) \
+				.sort([('date_created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]) \
+				.explain(),
+			'workflow_query_status': self._db.workflows \
+				.find({ 'status': '' }) \
+				.explain(),
+			'task_query': self._db.tasks \
+				.find(self.page_filter('utcTime', ('', '')), { '_id': 1, 'runName': 1, 'utcTime': 1, 'event': 1 }) \
+				.sort([('utcTime', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]) \
+				.explain(),
+			'pipeline_of_run': self._db.tasks \
+				.find({ 'event': 'started', 'runId': '' }, { 'metadata.workflow.projectName': 1 }) \
+				.explain(),
+			'task_query_pipeline': self._db.command('aggregate', 'tasks',
+				pipeline=self.task_query_pipeline_stages(''),
+				explain=True)
+		}
+
+	def plan_stages(self, plan):
+		# extract all stage names from a query plan
+		stages = []
+
+		if isinstance(plan, dict):
+			if 'stage' in plan:
+				stages.append(plan['stage'])
+
+			for key, value in plan.items():
+				if key != 'rejectedPlans':
+					stages += self.plan_stages(value)
+
+		elif isinstance(plan, list):
+			for value in plan:
+				stages += self.plan_stages(value)
+
+		return stages
+
+	async def explain_queries(self):
+		# warn about any query which performs a collection scan
+		for name, explain in self.query_shapes().items():
+			if 'COLLSCAN' in self.plan_stages(await explain):
+				print('warning: query %s performs a collection scan' % (name), flush=True)
+
+	def page_filter(self, key, after):
+		# select records which come after the given (key, id) cursor
+		if after == None:
+			return {}
+
+		value, id = after
+
+		return { '$or': [{ key: { '$lt': value } }, { key: value, '_id': { '$lt': id } }] }
+
+	async def workflow_query(self, page, page_size, after=None):
+		# use cursor instead of offset if specified
+		skip = page * page_size if after == None else 0
+
 		return await self._db.workflows \
-			.find() \
-			.sort('date_created', pymongo.DESCENDING) \
-			.skip(page * page_size) \
+			.find(self.page_filter('date_created', after)) \
+			.sort([('date_created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]) \
+			.skip(skip) \
 			.to_list(length=page_size)
 
+	async def workflow_query_status(self, status):
+		return await self._db.workflows \
+			.find({ 'status': status }) \
+			.to_list(length=None)
+
 	async def workflow_create(self, workflow):
 		return await self._db.workflows.insert_one(workflow)
 
@@ -247,45 +1111,183 @@ class MongoBackend(Backend):
 	async def workflow_update(self, id, workflow):
 		return await self._db.workflows.replace_one({ '_id': id }, workflow)
 
+	async def workflow_update_fields(self, id, fields):
+		return await self._db.workflows.update_one({ '_id': id }, { '$set': fields })
+
 	async def workflow_delete(self, id):
 		return await self._db.workflows.delete_one({ '_id': id })
 
-	async def task_query(self, page, page_size):
+	async def task_query(self, page, page_size, after=None):
+		# use cursor instead of offset if specified
+		skip = page * page_size if after == None else 0
+
 		return await self._db.tasks \
-			.find({}, { '_id': 1, 'runName': 1, 'utcTime': 1, 'event': 1 }) \
-			.sort('utcTime', pymongo.DESCENDING) \
-			.skip(page * page_size) \
+			.find(self.page_filter('utcTime', after), { '_id': 1, 'runName': 1, 'utcTime': 1, 'event': 1 }) \
+			.sort([('utcTime', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]) \
+			.skip(skip) \
 			.to_list(length=page_size)
 
 	async def task_query_pipelines(self):
-		# find all 'started' events
-		tasks = await self._db.tasks \
-			.find({ 'event': 'started' }, { 'metadata.workflow.projectName': 1 }) \
+		pipelines = await self._db.pipelines \
+			.find({}, { '_id': 1 }) \
 			.to_list(length=None)
 
-		# extract list of unique pipelines
-		pipelines = [t['metadata']['workflow']['projectName'] for t in tasks]
-		pipelines = list(set(pipelines))
+		return [p['_id'] for p in pipelines]
 
-		return pipelines
+	def task_query_pipeline_stages(self, pipeline, processes=None, by_process=False):
+		task_filter = { 'task.event': 'process_completed' }
 
-	async def task_query_pipeline(self, pipeline):
-		# find all runs of the given pipeline
-		runs = await self._db.tasks \
-			.find({ 'event': 'started', 'metadata.workflow.projectName': pipeline }, { 'runId': 1 }) \
-			.to_list(length=None)
+		if processes != None:
+			task_filter['task.trace.process'] = { '$in': list(processes) }
 
-		run_ids = [run['runId'] for run in runs]
+		stages = [
+			# find all runs of the given pipeline, a resumed run has
+			# a 'started' event for each attempt under the same run id
+			{ '$match': { 'event': 'started', 'metadata.workflow.projectName': pipeline } },
+			{ '$group': { '_id': '$runId' } },
 
-		# find all tasks associated with the given runs
-		tasks = await self._db.tasks \
-			.find({ 'event': 'process_completed', 'runId': { '$in': run_ids } }) \
-			.to_list(length=None)
+			# find all tasks associated with the given runs
+			{ '$lookup': { 'from': 'tasks', 'localField': '_id', 'foreignField': 'runId', 'as': 'task' } },
+			{ '$unwind': '$task' },
+			{ '$match': task_filter },
+			{ '$replaceRoot': { 'newRoot': '$task' } }
+		]
 
-		return tasks
+		if by_process:
+			stages.append({ '$sort': { 'trace.process': 1 } })
+
+		return stages
+
+	async def task_query_pipeline(self, pipeline, processes=None, by_process=False, batch_size=1000):
+		cursor = self._db.tasks.aggregate(self.task_query_pipeline_stages(pipeline, processes, by_process), batchSize=batch_size, allowDiskUse=True)
+
+		async for task in cursor:
+			yield task
 
 	async def task_create(self, task):
-		return await self._db.tasks.insert_one(task)
+		await self.task_create_many([task])
+
+	async def task_create_many(self, tasks):
+		# tasks which already exist were saved by an earlier attempt,
+		# so only other errors cause a task to be reported as failed
+		duplicates = set()
+		failed = set()
+
+		try:
+			await self._db.tasks.insert_many(tasks, ordered=False)
+		except pymongo.errors.BulkWriteError as e:
+			for error in e.details['writeErrors']:
+				if error['code'] == 11000:
+					duplicates.add(error['index'])
+				else:
+					failed.add(error['index'])
+
+		# add the inserted tasks to the catalog
+		await self.catalog_apply([task for i, task in enumerate(tasks) if i not in duplicates and i not in failed])
+
+		if failed:
+			raise TaskCreateError('failed to save %d of %d tasks' % (len(failed), len(tasks)), [tasks[i] for i in sorted(failed)])
 
 	async def task_get(self, id):
 		return await self._db.tasks.find_one({ '_id': id })
+
+	async def pipeline_of_run(self, run_id):
+		# find pipeline of a run from its 'started' event
+		if run_id not in self._run_pipelines:
+			run = await self._db.tasks.find_one({ 'event': 'started', 'runId': run_id }, { 'metadata.workflow.projectName': 1 })
+
+			if run == None:
+				return None
+
+			self._run_pipelines[run_id] = run['metadata']['workflow']['projectName']
+
+		return self._run_pipelines[run_id]
+
+	async def catalog_apply(self, tasks):
+		updates = []
+
+		# find the 'started' events of each run in this batch, a resumed run
+		# has a 'started' event for each attempt under the same run id
+		started = {}
+
+		for task in tasks:
+			if task['event'] == 'started':
+				started.setdefault(task['runId'], []).append(task['_id'])
+
+		for task in tasks:
+			# add run to catalog on its first 'started' event
+			if task['event'] == 'started':
+				pipeline = task['metadata']['workflow']['projectName']
+				self._run_pipelines[task['runId']] = pipeline
+
+				ids = started.pop(task['runId'], None)
+				new_run = ids != None and await self._db.tasks.find_one(
+					{ 'event': 'started', 'runId': task['runId'], '_id': { '$nin': ids } },
+					{ '_id': 1 }) == None
+
+				updates.append(pymongo.UpdateOne(
+					{ '_id': pipeline },
+					{ '$inc': { 'runs': 1 if new_run else 0 }, '$max': { 'last_run': task['utcTime'] }, '$setOnInsert': { 'processes': [] } },
+					upsert=True))
+
+			# add process to catalog on 'process_completed' event
+			elif task['event'] == 'process_completed':
+				pipeline = await self.pipeline_of_run(task['runId'])
+				process = task['trace']['process']
+
+				if pipeline != None and (pipeline, process) not in self._pipeline_processes:
+					self._pipeline_processes.add((pipeline, process))
+
+					updates.append(pymongo.UpdateOne(
+						{ '_id': pipeline },
+						{ '$addToSet': { 'processes': process } }))
+
+		if updates:
+			await self._db.pipelines.bulk_write(updates)
+
+	async def pipeline_query(self):
+		pipelines = await self._db.pipelines \
+			.find() \
+			.to_list(length=None)
+
+		return [{
+			'pipeline': p['_id'],
+			'runs': p['runs'],
+			'last_run': p['last_run'],
+			'processes': p['processes']
+		} for p in pipelines]
+
+	async def pipeline_rebuild(self):
+		# count distinct runs of each pipeline
+		runs = await self._db.tasks.aggregate([
+			{ '$match': { 'event': 'started' } },
+			{ '$group': {
+				'_id': { 'pipeline': '$metadata.workflow.projectName', 'runId': '$runId' },
+				'last_run': { '$max': '$utcTime' }
+			} },
+			{ '$group': {
+				'_id': '$_id.pipeline',
+				'runs': { '$sum': 1 },
+				'last_run': { '$max': '$last_run' }
+			} }
+		], allowDiskUse=True).to_list(length=None)
+
+		# find processes of each pipeline
+		processes = await self._db.tasks.aggregate([
+			{ '$match': { 'event': 'started' } },
+			{ '$project': { '_id': 0, 'runId': 1, 'pipeline': '$metadata.workflow.projectName' } },
+			{ '$lookup': { 'from': 'tasks', 'localField': 'runId', 'foreignField': 'runId', 'as': 'task' } },
+			{ '$unwind': '$task' },
+			{ '$match': { 'task.event': 'process_completed' } },
+			{ '$group': { '_id': '$pipeline', 'processes': { '$addToSet': '$task.trace.process' } } }
+		], allowDiskUse=True).to_list(length=None)
+
+		processes = {p['_id']: p['processes'] for p in processes}
+
+		# replace pipeline catalog
+		await self._db.pipelines.delete_many({})
+
+		if runs:
+			await self._db.pipelines.insert_many([{**r, 'processes': processes.get(r['_id'], [])} for r in runs])
+
+		self._pipeline_processes = set()
@@ -0,0 +1,148 @@
+import codecs
+import datetime
+import os
+import tornado.ioloop
+import tornado.queues
+import tornado.util
+
+import env
+
+
+
+def read_log(filename, offset=0, end=None):
+	# read a log file from the given byte offset, starting over
+	# if the offset is past the end of the file (e.g. on relaunch)
+	try:
+		with open(filename, 'rb') as f:
+			size = os.fstat(f.fileno()).st_size
+
+			if offset > size:
+				offset = 0
+
+			if end == None or end > size:
+				end = size
+
+			f.seek(offset)
+			data = f.read(max(0, end - offset))
+	except FileNotFoundError:
+		return '', 0, 0
+
+	# leave an incomplete utf-8 character at the end for the next read
+	decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+	log = decoder.decode(data, final=False)
+	pending, _ = decoder.getstate()
+
+	return log, offset, offset + len(data) - len(pending)
+
+
+
+class WorkflowWatcher():
+
+	def __init__(self, db, id, interval):
+		self._db = db
+		self._id = id
+		self._log_file = os.path.join(env.WORKFLOWS_DIR, id, '.workflow.log')
+		self._subscribers = set()
+		self._status = None
+		self._offset = None
+		self._polling = False
+		self._callback = tornado.ioloop.PeriodicCallback(self.poll, interval * 1000)
+
+	def subscribe(self, workflow):
+		queue = tornado.queues.Queue()
+
+		# send the log so far to the new subscriber, the first
+		# subscriber also sets the starting point of the watcher
+		log, start, offset = read_log(self._log_file, 0, self._offset)
+
+		if self._offset == None:
+			self._offset = offset
+			self._status = (workflow['status'], workflow['attempts'])
+			self._callback.start()
+
+		queue.put_nowait(('log', { 'log': log, 'start': start, 'offset': offset }))
+		queue.put_nowait(('status', { 'status': self._status[0], 'attempts': self._status[1] }))
+
+		self._subscribers.add(queue)
+
+		return queue
+
+	def unsubscribe(self, queue):
+		self._subscribers.discard(queue)
+
+		if not self._subscribers:
+			self._callback.stop()
+
+		return not self._subscribers
+
+	def publish(self, event, data):
+		for queue in self._subscribers:
+			queue.put_nowait((event, data))
+
+	def publish_status(self, status, attempts):
+		# only publish status transitions
+		if self._status != (status, attempts):
+			self._status = (status, attempts)
+			self.publish('status', { 'status': status, 'attempts': attempts })
+
+	async def poll(self):
+		# skip this poll if the previous one is still running
+		if self._polling:
+			return
+
+		self._polling = True
+
+		try:
+			# check workflow status, which may be changed by other processes
+			workflow = await self._db.workflow_get(self._id)
+			self.publish_status(workflow['status'], workflow['attempts'])
+
+			# publish new log output
+			log, start, offset = read_log(self._log_file, self._offset)
+
+			if log or start != self._offset:
+				self._offset = offset
+				self.publish('log', { 'log': log, 'start': start, 'offset': offset })
+		except Exception as e:
+			print('warning: failed to poll workflow %s: %s' % (self._id, e), flush=True)
+		finally:
+			self._polling = False
+
+
+
+class EventHub():
+
+	def __init__(self, db, interval=1.0):
+		self._db = db
+		self._interval = interval
+		self._watchers = {}
+
+	async def subscribe(self, id):
+		workflow = await self._db.workflow_get(id)
+
+		# create a single watcher per workflow for all subscribers
+		if id not in self._watchers:
+			self._watchers[id] = WorkflowWatcher(self._db, id, self._interval)
+
+		return self._watchers[id].subscribe(workflow)
+
+	def unsubscribe(self, id, queue):
+		if id in self._watchers and self._watchers[id].unsubscribe(queue):
+			del self._watchers[id]
+
+	def publish(self, id, event, data):
+		if id in self._watchers:
+			self._watchers[id].publish(event, data)
+
+	def publish_status(self, workflow):
+		if workflow['_id'] in self._watchers:
+			self._watchers[workflow['_id']].publish_status(workflow['status'], workflow['attempts'])
+
+
+
+async def listen(queue, timeout):
+	# wait for the next event, or return None after the timeout
+	try:
+		return await queue.get(timeout=datetime.timedelta(seconds=timeout))
+	except tornado.util.TimeoutError:
+		return None
@@ -0,0 +1,205 @@
+import asyncio
+import concurrent.futures
+import mmap
+import os
+import time
+import tornado.ioloop
+import tornado.locks
+
+import backend
+
+
+
+class TraceScanner():
+
+	PREFIX = b'#TRACE'
+
+	def __init__(self, sources=('.command.log', '.command.out', '.command.err'), max_bytes=1024 ** 2):
+		self._sources = sources
+		self._max_bytes = max_bytes
+
+	def scan(self, workdir):
+		# parse input features from trace directives in execution logs,
+		# returns the features and the number of bytes scanned
+		conditions = {}
+		n_bytes = 0
+
+		for source in self._sources:
+			try:
+				with open(os.path.join(workdir, source), 'rb') as f:
+					n_bytes += self.scan_file(f, conditions)
+			except FileNotFoundError:
+				pass
+
+		return conditions, n_bytes
+
+	def scan_file(self, f, conditions):
+		# empty files cannot be memory-mapped
+		size = os.fstat(f.fileno()).st_size
+
+		if size == 0:
+			return 0
+
+		# search for the directive prefix within the byte budget
+		limit = min(size, self._max_bytes)
+
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			start = mm.find(self.PREFIX, 0, limit)
+
+			while start != -1:
+				line_start = mm.rfind(b'\n', 0, start) + 1
+				line_end = mm.find(b'\n', start, limit)
+
+				# skip directives which are cut off by the byte budget
+				if line_end == -1:
+					if limit < size:
+						break
+
+					line_end = limit
+
+				# only accept directives at the start of a line,
+				# skipping malformed directives without a value
+				if mm[line_start:start].strip() == b'':
+					line = mm[start + len(self.PREFIX):line_end].decode(errors='replace')
+
+					if '=' in line:
+						k, v = line.split('=', 1)
+						conditions[k.strip()] = v.strip()
+
+				start = mm.find(self.PREFIX, line_end, limit)
+
+		return limit
+
+
+
+class TaskQueue():
+
+	def __init__(self, db, trace_store=None, trace_scanner=None, batch_size=100, flush_interval=1.0, max_workers=4, max_retries=5):
+		self._db = db
+		self._trace_store = trace_store
+		self._trace_scanner = trace_scanner if trace_scanner != None else TraceScanner()
+		self._batch_size = batch_size
+		self._flush_interval = flush_interval
+		self._max_retries = max_retries
+		self._tasks = []
+		self._retries = {}
+		self._futures = {}
+		self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+		self.metrics = {
+			'tasks_scanned': 0,
+			'bytes_scanned': 0,
+			'max_bytes_scanned': 0
+		}
+		self._lock = tornado.locks.Lock()
+		self._timeout = None
+
+	def put(self, task):
+		# start reading trace directives of completed processes in the
+		# background, since the work directory may be on a slow filesystem
+		if task['event'] == 'process_completed':
+			self._futures[task['_id']] = self._executor.submit(self._trace_scanner.scan, task['trace']['workdir'])
+
+		# append task to queue
+		self._tasks.append(task)
+
+		# flush queue once it has a full batch
+		if len(self._tasks) >= self._batch_size:
+			tornado.ioloop.IOLoop.current().spawn_callback(self.flush)
+
+		# otherwise make sure that the queue is flushed eventually
+		else:
+			self.schedule()
+
+	def schedule(self, delay=None):
+		if self._timeout == None:
+			self._timeout = tornado.ioloop.IOLoop.current().call_later(delay or self._flush_interval, self.flush)
+
+	async def flush(self, run_id=None):
+		# flushes are serialized, so any task which was queued before this
+		# call is saved or waiting to be retried by the time it returns,
+		# raises an error if a task of the given run was not saved
+		async with self._lock:
+			if self._timeout != None:
+				tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+				self._timeout = None
+
+			# retry failed tasks once their backoff has passed, or
+			# right away if they belong to the given run
+			now = time.time()
+			retries = [task for retry_time, _, task in self._retries.values() if retry_time <= now or (run_id != None and task.get('runId') == run_id)]
+			tasks, self._tasks = self._tasks + retries, []
+			saved = []
+
+			if tasks:
+				await self.enrich(tasks)
+
+				# take the trace store generation before saving tasks, so that
+				# the trace store can tell whether it was rebuilt in between
+				generation = self._trace_store.generation() if self._trace_store != None else None
+				saved = await self.save(tasks)
+
+				if self._trace_store != None:
+					await self._trace_store.append(self._db, saved, generation)
+
+			# make sure that the remaining retries are flushed eventually
+			if self._retries:
+				self.schedule(max(0, min(retry_time for retry_time, _, _ in self._retries.values()) - now))
+
+			# report tasks of the given run which were not saved
+			saved_ids = set(task['_id'] for task in saved)
+			failed = [task for task in tasks if run_id != None and task.get('runId') == run_id and task['_id'] not in saved_ids]
+
+			if failed:
+				raise backend.TaskCreateError('failed to save %d tasks of run %s' % (len(failed), run_id), failed)
+
+	async def enrich(self, tasks):
+		# append input features from trace directives to task traces
+		for task in tasks:
+			future = self._futures.pop(task['_id'], None)
+
+			if future == None:
+				continue
+
+			try:
+				conditions, n_bytes = await asyncio.wrap_future(future)
+				task['trace'] = {**task['trace'], **conditions}
+
+				# update scan metrics
+				self.metrics['tasks_scanned'] += 1
+				self.metrics['bytes_scanned'] += n_bytes
+				self.metrics['max_bytes_scanned'] = max(self.metrics['max_bytes_scanned'], n_bytes)
+			except Exception as e:
+				print('warning: failed to read trace directives for task %s: %s' % (task['_id'], e), flush=True)
+
+	async def save(self, tasks):
+		# save tasks and return the tasks which were saved, saving tasks
+		# again is safe since tasks which already exist are skipped
+		try:
+			await self._db.task_create_many(tasks)
+			failed = []
+		except backend.TaskCreateError as e:
+			print('warning: failed to save tasks: %s' % (e), flush=True)
+			failed = e.tasks
+		except Exception as e:
+			print('warning: failed to save tasks: %s' % (e), flush=True)
+			failed = tasks
+
+		failed_ids = set(task['_id'] for task in failed)
+
+		for task in tasks:
+			if task['_id'] not in failed_ids:
+				self._retries.pop(task['_id'], None)
+
+		# retry failed tasks with exponential backoff, and drop
+		# the tasks which have failed too many times
+		for task in failed:
+			_, attempts, _ = self._retries.get(task['_id'], (None, 0, None))
+
+			if attempts < self._max_retries:
+				retry_time = time.time() + self._flush_interval * 2 ** attempts
+				self._retries[task['_id']] = (retry_time, attempts + 1, task)
+			else:
+				print('warning: dropping task %s after %d failed attempts' % (task['_id'], attempts + 1), flush=True)
+				self._retries.pop(task['_id'], None)
+
+		return [task for task in tasks if task['_id'] not in failed_ids]
@@ -0,0 +1,156 @@
+import os
+import time
+import tornado.ioloop
+
+import archive
+import workflow as Workflow
+
+
+
+# default number of workflows which may run at once on each executor
+DEFAULT_SLOTS = {
+	'k8s': 16,
+	'local': 2,
+	'pbspro': 16
+}
+
+
+
+def parse_slots(specs):
+	# parse slot limits of the form <executor>:<slots>
+	slots = dict(DEFAULT_SLOTS)
+
+	for spec in specs:
+		executor, n = spec.split(':')
+		slots[executor.strip()] = int(n)
+
+	return slots
+
+
+
+def load_per_cpu():
+	# 1-minute load average relative to the number of usable cpus
+	return os.getloadavg()[0] / len(os.sched_getaffinity(0))
+
+
+
+def mem_available():
+	# available memory in bytes, or None if it cannot be determined
+	try:
+		with open('/proc/meminfo') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+
+	return None
+
+
+
+# queue of workflows waiting to be launched, which is stored in the
+# workflow documents (status 'queued') so that it survives a restart
+class LaunchQueue():
+
+	def __init__(self, db, event_hub, slots, max_load=0, min_memory=0, interval=5.0, archiver=None):
+		self._db = db
+		self._event_hub = event_hub
+		self._archiver = archiver if archiver != None else archive.Archiver()
+		self._slots = slots
+		self._max_load = max_load
+		self._min_memory = min_memory
+		self._running = {}
+		self._active = False
+		self._scheduling = False
+		self._callback = tornado.ioloop.PeriodicCallback(self.schedule, interval * 1000)
+
+	def start(self):
+		# only one server process launches workflows, the others
+		# only add workflows to the queue
+		self._active = True
+		self._callback.start()
+		self.wake()
+
+	def wake(self):
+		if self._active:
+			tornado.ioloop.IOLoop.current().spawn_callback(self.schedule)
+
+	def has_capacity(self):
+		# check node resources before launching another workflow, which
+		# only reflect the workload of the local executor
+		if self._max_load > 0 and load_per_cpu() >= self._max_load:
+			return False
+
+		if self._min_memory > 0:
+			available = mem_available()
+
+			if available != None and available < self._min_memory:
+				return False
+
+		return True
+
+	def priority(self, workflow):
+		# workflows saved before priorities were validated may have
+		# a missing or invalid priority, which is treated as 0
+		try:
+			return int(workflow.get('priority') or 0)
+		except (TypeError, ValueError):
+			return 0
+
+	async def schedule(self):
+		# skip if the previous round is still running
+		if self._scheduling:
+			return
+
+		self._scheduling = True
+
+		try:
+			queued = await self._db.workflow_query_status('queued')
+
+			# launch workflows by priority and then in order of submission
+			queued.sort(key=lambda w: (-self.priority(w), w.get('date_queued') or 0, w['_id']))
+
+			for workflow in queued:
+				if len(self._running) >= self._slots or not self.has_capacity():
+					break
+
+				await self.launch(workflow)
+
+				# launch one workflow per round when checking node resources,
+				# so that each check reflects the workflows launched before it
+				if self._max_load > 0 or self._min_memory > 0:
+					break
+		except Exception as e:
+			print('warning: failed to schedule workflows: %s' % (e), flush=True)
+		finally:
+			self._scheduling = False
+
+	async def launch(self, workflow):
+		id = workflow['_id']
+
+		# make sure that the workflow was not cancelled in the meantime
+		workflow = await self._db.workflow_get(id)
+
+		if workflow['status'] != 'queued':
+			return
+
+		# update workflow status
+		workflow['status'] = 'running'
+		workflow['date_submitted'] = int(time.time() * 1000)
+		workflow['attempts'] += 1
+
+		await self._db.workflow_update(id, workflow)
+		self._event_hub.publish_status(workflow)
+
+		# launch workflow in the background and free its slot once nextflow
+		# exits, so that archiving the output does not hold back other workflows
+		task = Workflow.launch(self._db, workflow, workflow.get('resume', False), self._archiver, on_exit=lambda: self.finish(id, task))
+		task.add_done_callback(lambda _: self.finish(id, task))
+
+		self._running[id] = task
+
+	def finish(self, id, task):
+		# the workflow may have been relaunched while its output was saved
+		if self._running.get(id) is task:
+			del self._running[id]
+			self.wake()
@@ -0,0 +1,109 @@
+import collections
+import os
+import threading
+import time
+
+
+
+# cache of recursive directory listings, each directory is only scanned
+# again when its mtime changes or when its listing is older than max_age,
+# which catches files that grow without changing the directory mtime,
+# only the max_trees most recently listed directories are kept
+class ListingCache():
+
+	def __init__(self, max_age=30, max_trees=256):
+		self._max_age = max_age
+		self._max_trees = max_trees
+		self._dirs = {}
+		self._trees = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	def evict(self, root):
+		# remove cached listings of a directory and its subdirectories
+		with self._lock:
+			self._evict(root)
+
+	def _evict(self, root):
+		self._dirs = {k: v for k, v in self._dirs.items() if k != root and not k.startswith(root + os.sep)}
+
+		for key in [key for key in self._trees if key[0] == root or key[0].startswith(root + os.sep)]:
+			del self._trees[key]
+
+	def scan_dir(self, path):
+		# use cached listing if directory has not changed
+		st = os.stat(path)
+		entry = self._dirs.get(path)
+
+		if entry != None and entry['mtime'] == st.st_mtime_ns and time.time() - entry['time'] < self._max_age:
+			return entry, False
+
+		# otherwise list subdirectories and files with their sizes
+		subdirs = []
+		files = []
+
+		with os.scandir(path) as it:
+			for e in it:
+				if e.is_dir(follow_symlinks=False):
+					subdirs.append(e.name)
+				elif not e.is_dir():
+					try:
+						files.append((e.name, e.stat().st_size))
+					except OSError:
+						files.append((e.name, None))
+
+		# remove cached listings of subdirectories which were removed
+		if entry != None:
+			for name in set(entry['subdirs']) - set(subdirs):
+				prefix = os.path.join(path, name)
+				self._dirs = {k: v for k, v in self._dirs.items() if k != prefix and not k.startswith(prefix + os.sep)}
+
+		entry = {
+			'mtime': st.st_mtime_ns,
+			'time': time.time(),
+			'subdirs': subdirs,
+			'files': files
+		}
+		self._dirs[path] = entry
+
+		return entry, True
+
+	def list(self, root, relpath_start=''):
+		# list all files under a directory, sorted by relative path
+		with self._lock:
+			changed = False
+			stack = [root]
+			files = []
+
+			while stack:
+				path = stack.pop()
+
+				try:
+					entry, dir_changed = self.scan_dir(path)
+				except FileNotFoundError:
+					self._dirs.pop(path, None)
+					changed = True
+					continue
+
+				changed = changed or dir_changed
+				stack += [os.path.join(path, name) for name in entry['subdirs']]
+				files += [(os.path.join(path, name), size) for name, size in entry['files']]
+
+			# reuse the sorted listing if no directory has changed
+			key = (root, relpath_start)
+
+			if not changed and key in self._trees:
+				self._trees.move_to_end(key)
+				return self._trees[key]
+
+			files = [{ 'name': os.path.relpath(f, start=relpath_start), 'size': size } for f, size in files]
+			files.sort(key=lambda f: f['name'])
+
+			self._trees[key] = files
+			self._trees.move_to_end(key)
+
+			# evict the least recently listed directories
+			while len(self._trees) > self._max_trees:
+				(oldest, _), _ = self._trees.popitem(last=False)
+				self._evict(oldest)
+
+			return files
@@ -2,9 +2,10 @@
 
 import base64
 import bson
+import collections
 import json
-import multiprocessing as mp
 import os
+import re
 import pandas as pd
 import shutil
 import socket
@@ -13,24 +14,82 @@ import time
 import tornado
 import tornado.escape
 import tornado.httpserver
+import tornado.httputil
 import tornado.ioloop
+import tornado.iostream
 import tornado.options
+import tornado.process
 import tornado.web
 
+import archive
 import backend
 import env
+import events
+import ingest
+import launchqueue
+import listing
+import tracestore
+import upload
 import model as Model
 import visualizer as Visualizer
 import workflow as Workflow
 
 
 
-def list_dir_recursive(path, relpath_start=''):
-	files = [os.path.join(dir, f) for (dir, subdirs, filenames) in os.walk(path) for f in filenames]
-	files = [os.path.relpath(f, start=relpath_start) for f in files]
-	files.sort()
+def get_upload_session(id, session_id):
+	return upload.UploadSession(os.path.join(env.WORKFLOWS_DIR, id, '.uploads'), session_id)
 
-	return files
+
+
+def cleanup_upload_sessions(max_age):
+	# remove stale upload sessions of every workflow
+	try:
+		ids = os.listdir(env.WORKFLOWS_DIR)
+	except FileNotFoundError:
+		return
+
+	for id in ids:
+		upload.cleanup_sessions(os.path.join(env.WORKFLOWS_DIR, id, '.uploads'), max_age)
+
+
+
+def encode_cursor(key, id):
+	# encode the position of a record as an opaque page cursor
+	return base64.urlsafe_b64encode(json.dumps([key, id]).encode('utf-8')).decode('utf-8')
+
+
+
+def decode_cursor(cursor, key_type):
+	# decode page cursor, an empty cursor refers to the first page,
+	# the cursor must match the types of the sort key and id
+	if not cursor:
+		return None
+
+	after = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+
+	if not isinstance(after, list) or len(after) != 2:
+		raise ValueError('Invalid cursor')
+
+	key, id = after
+
+	if type(key) != key_type or not isinstance(id, str):
+		raise ValueError('Invalid cursor')
+
+	return after
+
+
+
+def page_response(records, page_size, key):
+	# append cursor of the next page if the current page is full
+	if len(records) == page_size:
+		next = encode_cursor(records[-1][key], records[-1]['_id'])
+	else:
+		next = None
+
+	return {
+		'items': records,
+		'next': next
+	}
 
 
 
@@ -42,14 +101,38 @@ def message(status, message):
 
 
 
+def parse_priority(data):
+	# coerce the launch priority of a workflow to an integer,
+	# a cleared priority field is sent as null
+	if 'priority' in data:
+		data['priority'] = int(data['priority']) if data['priority'] != None else 0
+
+
+
 class WorkflowQueryHandler(tornado.web.RequestHandler):
 
 	async def get(self):
 		page = int(self.get_query_argument('page', 0))
 		page_size = int(self.get_query_argument('page_size', 100))
+		after = self.get_query_argument('after', None)
 
 		db = self.settings['db']
-		workflows = await db.workflow_query(page, page_size)
+
+		# use cursor pagination if cursor is specified
+		if after != None:
+			try:
+				after = decode_cursor(after, int)
+			except ValueError:
+				self.set_status(400)
+				self.write(message(400, 'Invalid cursor'))
+				return
+
+			workflows = await db.workflow_query(0, page_size, after)
+			workflows = page_response(workflows, page_size, 'date_created')
+
+		# otherwise use offset pagination
+		else:
+			workflows = await db.workflow_query(page, page_size)
 
 		self.set_status(200)
 		self.set_header('content-type', 'application/json')
@@ -71,7 +154,8 @@ class WorkflowCreateHandler(tornado.web.RequestHandler):
 		'revision': 'master',
 		'input_dir': 'input',
 		'output_dir': 'output',
-		'attempts': 0
+		'attempts': 0,
+		'priority': 0
 	}
 
 	def get(self):
@@ -98,6 +182,13 @@ class WorkflowCreateHandler(tornado.web.RequestHandler):
 			self.write(message(400, 'Missing required field(s): %s' % list(missing_keys)))
 			return
 
+		try:
+			parse_priority(data)
+		except (TypeError, ValueError):
+			self.set_status(400)
+			self.write(message(400, 'Invalid priority'))
+			return
+
 		# create workflow
 		workflow = {**self.DEFAULTS, **data, **{ 'status': 'nascent' }}
 		workflow['_id'] = str(bson.ObjectId())
@@ -136,7 +227,8 @@ class WorkflowEditHandler(tornado.web.RequestHandler):
 		'revision': 'master',
 		'input_dir': 'input',
 		'output_dir': 'output',
-		'attempts': 0
+		'attempts': 0,
+		'priority': 0
 	}
 
 	async def get(self, id):
@@ -146,23 +238,8 @@ class WorkflowEditHandler(tornado.web.RequestHandler):
 			# get workflow
 			workflow = await db.workflow_get(id)
 
-			# append list of input files
-			workflow_dir = os.path.join(env.WORKFLOWS_DIR, id)
-			input_dir = os.path.join(workflow_dir, workflow['input_dir'])
-			output_dir = os.path.join(workflow_dir, workflow['output_dir'])
-
-			if os.path.exists(input_dir):
-				workflow['input_files'] = list_dir_recursive(input_dir, relpath_start=workflow_dir)
-			else:
-				workflow['input_files'] = []
-
-			# append list of output files
-			if os.path.exists(output_dir):
-				workflow['output_files'] = list_dir_recursive(output_dir, relpath_start=workflow_dir)
-			else:
-				workflow['output_files'] = []
-
 			# append status of output data
+			workflow_dir = os.path.join(env.WORKFLOWS_DIR, id)
 			workflow['output_data'] = os.path.exists('%s/%s-output.tar.gz' % (workflow_dir, id))
 
 			self.set_status(200)
@@ -188,6 +265,13 @@ class WorkflowEditHandler(tornado.web.RequestHandler):
 			self.write(message(400, 'Missing required field(s): %s' % list(missing_keys)))
 			return
 
+		try:
+			parse_priority(data)
+		except (TypeError, ValueError):
+			self.set_status(400)
+			self.write(message(400, 'Invalid priority'))
+			return
+
 		try:
 			# update workflow from request body
 			workflow = await db.workflow_get(id)
@@ -213,8 +297,9 @@ class WorkflowEditHandler(tornado.web.RequestHandler):
 			# delete workflow
 			await db.workflow_delete(id)
 
-			# delete workflow directory
+			# delete workflow directory and its cached listings
 			shutil.rmtree(os.path.join(env.WORKFLOWS_DIR, id), ignore_errors=True)
+			self.settings['listing_cache'].evict(os.path.join(env.WORKFLOWS_DIR, id))
 
 			self.set_status(200)
 			self.write(message(200, 'Workflow \"%s\" was deleted' % id))
@@ -225,41 +310,287 @@ class WorkflowEditHandler(tornado.web.RequestHandler):
 
 
 
+class WorkflowFilesHandler(tornado.web.RequestHandler):
+
+	async def get(self, id):
+		db = self.settings['db']
+		listing_cache = self.settings['listing_cache']
+
+		try:
+			dir = self.get_query_argument('dir', 'output')
+			page = int(self.get_query_argument('page', 0))
+			page_size = int(self.get_query_argument('page_size', 100))
+
+			if dir not in ['input', 'output']:
+				raise ValueError('invalid directory')
+		except ValueError:
+			self.set_status(400)
+			self.write(message(400, 'Invalid query'))
+			return
+
+		try:
+			# get workflow
+			workflow = await db.workflow_get(id)
+
+			# list files of input or output directory
+			workflow_dir = os.path.join(env.WORKFLOWS_DIR, id)
+			path = os.path.join(workflow_dir, workflow['%s_dir' % (dir)])
+
+			loop = tornado.ioloop.IOLoop.current()
+			files = await loop.run_in_executor(None, listing_cache.list, path, workflow_dir)
+
+			# construct response data
+			data = {
+				'items': files[(page * page_size):((page + 1) * page_size)],
+				'total': len(files)
+			}
+
+			self.set_status(200)
+			self.set_header('content-type', 'application/json')
+			self.write(tornado.escape.json_encode(data))
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to list files for workflow \"%s\"' % id))
+
+
+
+@tornado.web.stream_request_body
 class WorkflowUploadHandler(tornado.web.RequestHandler):
 
-	async def post(self, id):
+	async def prepare(self):
 		db = self.settings['db']
+		self.parser = None
+		self.error = None
 
-		# make sure request body contains files
-		files = self.request.files
+		# allow uploads larger than the server buffer size,
+		# since the request body is written directly to disk
+		self.request.connection.set_max_body_size(self.settings['upload_max_bytes'])
+
+		# make sure request body is multipart form data
+		content_type = self.request.headers.get('Content-Type', '')
+		m = re.search(r'boundary="?([^";]+)"?', content_type)
 
-		if not files:
+		if not content_type.startswith('multipart/form-data') or m == None:
 			self.set_status(400)
-			self.write(message(400, 'No files were uploaded'))
+			self.finish(message(400, 'No files were uploaded'))
 			return
 
 		# get workflow
-		workflow = await db.workflow_get(id)
+		id = self.path_args[0]
+
+		try:
+			workflow = await db.workflow_get(id)
+		except:
+			self.set_status(404)
+			self.finish(message(404, 'Failed to get workflow \"%s\"' % id))
+			return
 
-		# initialize input directory
+		# initialize input directory and staging directory, so that
+		# partially uploaded files never appear in the input directory
 		input_dir = os.path.join(env.WORKFLOWS_DIR, id, workflow['input_dir'])
+		staging_dir = os.path.join(env.WORKFLOWS_DIR, id, '.uploads', 'staging')
 		os.makedirs(input_dir, exist_ok=True)
+		os.makedirs(staging_dir, exist_ok=True)
+
+		# initialize parser to save uploaded files to input directory
+		self.parser = upload.MultipartParser(m.group(1).encode(), input_dir, staging_dir)
+
+	def data_received(self, chunk):
+		if self.parser == None or self.error != None:
+			return
 
-		# save uploaded files to input directory
-		filenames = []
+		try:
+			self.parser.feed(chunk)
+		except Exception as e:
+			self.parser.abort()
+			self.error = e
+
+	def on_connection_close(self):
+		# remove partially uploaded file
+		if self.parser != None:
+			self.parser.abort()
+
+	async def post(self, id):
+		# make sure request body was parsed successfully
+		try:
+			if self.error != None:
+				raise self.error
+
+			self.parser.finish()
+		except Exception as e:
+			self.set_status(400)
+			self.write(message(400, 'Failed to upload files: %s' % (e)))
+			return
+
+		# make sure request body contains files
+		filenames = self.parser.filenames
 
-		for f_list in files.values():
-			for f_arg in f_list:
-				filename, body = f_arg['filename'], f_arg['body']
-				with open(os.path.join(input_dir, filename), 'wb') as f:
-					f.write(body)
-				filenames.append(filename)
+		if not filenames:
+			self.set_status(400)
+			self.write(message(400, 'No files were uploaded'))
+			return
 
 		self.set_status(200)
 		self.write(message(200, 'File \"%s\" was uploaded for workflow \"%s\" successfully' % (filenames, id)))
 
 
 
+class WorkflowUploadSessionsHandler(tornado.web.RequestHandler):
+
+	async def post(self, id):
+		db = self.settings['db']
+
+		# make sure request body is valid
+		try:
+			data = tornado.escape.json_decode(self.request.body)
+			filename = data['filename']
+			size = int(data['size'])
+			chunk_size = int(data.get('chunk_size', 8 * 1024 ** 2))
+			sha256 = data.get('sha256')
+		except:
+			self.set_status(422)
+			self.write(message(422, 'Ill-formatted JSON'))
+			return
+
+		try:
+			# get workflow
+			workflow = await db.workflow_get(id)
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to get workflow \"%s\"' % id))
+			return
+
+		try:
+			# create upload session
+			workflow_dir = os.path.join(env.WORKFLOWS_DIR, id)
+			session = upload.UploadSession.create(
+				os.path.join(workflow_dir, '.uploads'),
+				os.path.join(workflow_dir, workflow['input_dir']),
+				filename,
+				size,
+				chunk_size,
+				sha256,
+				max_size=self.settings['upload_max_bytes'])
+
+			self.set_status(200)
+			self.set_header('content-type', 'application/json')
+			self.write(tornado.escape.json_encode(session.status()))
+		except ValueError as e:
+			self.set_status(400)
+			self.write(message(400, 'Failed to create upload session: %s' % (e)))
+
+
+
+class WorkflowUploadSessionHandler(tornado.web.RequestHandler):
+
+	async def get(self, id, session_id):
+		try:
+			session = get_upload_session(id, session_id)
+			data = session.status()
+
+			self.set_status(200)
+			self.set_header('content-type', 'application/json')
+			self.write(tornado.escape.json_encode(data))
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to get upload session \"%s\"' % session_id))
+
+	async def delete(self, id, session_id):
+		try:
+			session = get_upload_session(id, session_id)
+			session.abort()
+
+			self.set_status(200)
+			self.write(message(200, 'Upload session \"%s\" was deleted' % session_id))
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to delete upload session \"%s\"' % session_id))
+
+
+
+@tornado.web.stream_request_body
+class WorkflowUploadChunkHandler(tornado.web.RequestHandler):
+
+	def prepare(self):
+		id, session_id, index = self.path_args
+		self.writer = None
+		self.error = None
+
+		# open output file at the offset of the chunk
+		try:
+			session = get_upload_session(id, session_id)
+			self.writer = session.open_chunk(int(index))
+			self.session = session
+		except:
+			self.set_status(404)
+			self.finish(message(404, 'Failed to get chunk %s of upload session \"%s\"' % (index, session_id)))
+			return
+
+		self.request.connection.set_max_body_size(session.data['chunk_size'])
+
+	def data_received(self, chunk):
+		if self.writer == None or self.error != None:
+			return
+
+		try:
+			self.writer.write(chunk)
+		except Exception as e:
+			self.error = e
+
+	def on_connection_close(self):
+		if self.writer != None:
+			self.writer.close()
+			self.writer = None
+
+	async def put(self, id, session_id, index):
+		# make sure that the whole chunk was received
+		complete = self.writer.close()
+		self.writer = None
+
+		if self.error != None or not complete:
+			self.set_status(400)
+			self.write(message(400, 'Chunk %s of upload session \"%s\" is incomplete' % (index, session_id)))
+			return
+
+		# record chunk as received
+		self.session.mark_chunk(int(index))
+
+		self.set_status(200)
+		self.write(message(200, 'Chunk %s of upload session \"%s\" was received' % (index, session_id)))
+
+
+
+class WorkflowUploadFinalizeHandler(tornado.web.RequestHandler):
+
+	async def post(self, id, session_id):
+		# parse optional checksum from request body
+		try:
+			data = tornado.escape.json_decode(self.request.body) if self.request.body else {}
+		except json.JSONDecodeError:
+			self.set_status(422)
+			self.write(message(422, 'Ill-formatted JSON'))
+			return
+
+		try:
+			session = get_upload_session(id, session_id)
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to get upload session \"%s\"' % session_id))
+			return
+
+		# verify and move file into the input directory
+		try:
+			loop = tornado.ioloop.IOLoop.current()
+			filename = await loop.run_in_executor(None, session.finalize, data.get('sha256'))
+
+			self.set_status(200)
+			self.write(message(200, 'File \"%s\" was uploaded for workflow \"%s\" successfully' % (filename, id)))
+		except ValueError as e:
+			self.set_status(400)
+			self.write(message(400, 'Failed to finalize upload session \"%s\": %s' % (session_id, e)))
+
+
+
 class WorkflowLaunchHandler(tornado.web.RequestHandler):
 
 	resume = False
@@ -271,10 +602,10 @@ class WorkflowLaunchHandler(tornado.web.RequestHandler):
 			# get workflow
 			workflow = await db.workflow_get(id)
 
-			# make sure workflow is not already running
-			if workflow['status'] == 'running':
+			# make sure workflow is not already running or queued
+			if workflow['status'] in ['queued', 'running']:
 				self.set_status(400)
-				self.write(message(400, 'Workflow \"%s\" is already running' % id))
+				self.write(message(400, 'Workflow \"%s\" is already %s' % (id, workflow['status'])))
 				return
 
 			# copy nextflow.config from input directory if it exists
@@ -295,19 +626,17 @@ class WorkflowLaunchHandler(tornado.web.RequestHandler):
 				f.write('weblog { enabled = true\n url = \"%s\" }\n' % (weblog_url))
 				f.write('k8s { launchDir = \"%s\" }\n' % (workflow_dir))
 
-			# update workflow status
-			workflow['status'] = 'running'
-			workflow['date_submitted'] = int(time.time() * 1000)
-			workflow['attempts'] += 1
+			# add workflow to the launch queue
+			workflow['status'] = 'queued'
+			workflow['date_queued'] = int(time.time() * 1000)
+			workflow['resume'] = self.resume
 
 			await db.workflow_update(id, workflow)
-
-			# launch workflow as a child process
-			p = mp.Process(target=Workflow.launch, args=(db, workflow, self.resume))
-			p.start()
+			self.settings['event_hub'].publish_status(workflow)
+			self.settings['launch_queue'].wake()
 
 			self.set_status(200)
-			self.write(message(200, 'Workflow \"%s\" was launched' % id))
+			self.write(message(200, 'Workflow \"%s\" was queued for launch' % id))
 		except:
 			self.set_status(404)
 			self.write(message(404, 'Failed to launch workflow \"%s\"' % id))
@@ -330,14 +659,16 @@ class WorkflowCancelHandler(tornado.web.RequestHandler):
 			workflow = await db.workflow_get(id)
 			workflow = {**{ 'pid': -1 }, **workflow}
 
-			# cancel workflow
-			Workflow.cancel(workflow)
+			# cancel workflow, queued workflows are only removed from the queue
+			if workflow['status'] != 'queued':
+				await Workflow.cancel(workflow)
 
 			# update workflow status
 			workflow['status'] = 'failed'
 			workflow['pid'] = -1
 
 			await db.workflow_update(id, workflow)
+			self.settings['event_hub'].publish_status(workflow)
 
 			self.set_status(200)
 			self.write(message(200, 'Workflow \"%s\" was canceled' % id))
@@ -352,30 +683,51 @@ class WorkflowLogHandler(tornado.web.RequestHandler):
 	async def get(self, id):
 		db = self.settings['db']
 
+		try:
+			# parse byte offset of the log
+			offset = int(self.get_query_argument('offset', 0))
+		except ValueError:
+			self.set_status(400)
+			self.write(message(400, 'Invalid offset'))
+			return
+
 		try:
 			# get workflow
 			workflow = await db.workflow_get(id)
 
-			# append log if it exists
+			# skip reading the log if nothing has changed
 			log_file = os.path.join(env.WORKFLOWS_DIR, id, '.workflow.log')
 
-			if os.path.exists(log_file):
-				f = open(log_file)
-				log = ''.join(f.readlines())
-			else:
-				log = ''
+			try:
+				st = os.stat(log_file)
+				log_version = '%d-%d-%d' % (st.st_ino, st.st_size, st.st_mtime_ns)
+			except FileNotFoundError:
+				log_version = ''
+
+			self.set_header('cache-control', 'no-cache')
+			self.set_header('etag', '"%s"' % base64.urlsafe_b64encode(json.dumps(
+				[workflow['status'], workflow['attempts'], log_version, offset]
+			).encode()).decode())
+
+			if self.check_etag_header():
+				self.set_status(304)
+				return
+
+			# read log from the given offset
+			log, start, next_offset = events.read_log(log_file, offset)
 
 			# construct response data
 			data = {
 				'_id': id,
 				'status': workflow['status'],
 				'attempts': workflow['attempts'],
-				'log': log
+				'log': log,
+				'start': start,
+				'offset': next_offset
 			}
 
 			self.set_status(200)
 			self.set_header('content-type', 'application/json')
-			self.set_header('cache-control', 'no-store, no-cache, must-revalidate, max-age=0')
 			self.write(tornado.escape.json_encode(data))
 		except:
 			self.set_status(404)
@@ -383,8 +735,192 @@ class WorkflowLogHandler(tornado.web.RequestHandler):
 
 
 
+class WorkflowEventsHandler(tornado.web.RequestHandler):
+
+	async def get(self, id):
+		event_hub = self.settings['event_hub']
+
+		try:
+			# subscribe to workflow events
+			self.queue = await event_hub.subscribe(id)
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to fetch events for workflow \"%s\"' % id))
+			return
+
+		self.set_status(200)
+		self.set_header('content-type', 'text/event-stream')
+		self.set_header('cache-control', 'no-cache')
+
+		try:
+			# stream workflow events until the client disconnects
+			while True:
+				event = await events.listen(self.queue, 15)
+
+				if event != None:
+					name, data = event
+					self.write('event: %s\ndata: %s\n\n' % (name, tornado.escape.json_encode(data)))
+				else:
+					self.write(': keepalive\n\n')
+
+				await self.flush()
+		except tornado.iostream.StreamClosedError:
+			pass
+		finally:
+			event_hub.unsubscribe(id, self.queue)
+
+	def on_connection_close(self):
+		# wake up the event loop so that it notices the closed stream
+		if hasattr(self, 'queue'):
+			self.queue.put_nowait(None)
+
+
+
 class WorkflowDownloadHandler(tornado.web.StaticFileHandler):
 
+	FORMATS = {
+		'tar': ('application/x-tar', 'tar'),
+		'tgz': ('application/gzip', 'tar.gz')
+	}
+
+	# number of blocks which are read and compressed ahead of the response
+	PREFETCH = 4
+
+	# number of bytes read at a time when serving a file
+	READ_SIZE = 1024 ** 2
+
+	async def get(self, id, include_body=True):
+		format = self.get_query_argument('format', None)
+
+		# serve output file or data archive if no format is specified
+		if format == None:
+			self.check_if_range(id)
+
+			return await super().get(id, include_body)
+
+		if format not in self.FORMATS:
+			self.set_status(400)
+			self.write(message(400, 'Format must be one of %s' % list(self.FORMATS.keys())))
+			return
+
+		db = self.settings['db']
+
+		try:
+			workflow = await db.workflow_get(id)
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to get workflow \"%s\"' % id))
+			return
+
+		# resolve selected subdirectory of the output directory
+		output_dir = os.path.normpath(os.path.join(self.root, id, workflow['output_dir']))
+		src_dir = os.path.normpath(os.path.join(output_dir, self.get_query_argument('dir', '')))
+		pattern = self.get_query_argument('glob', None)
+
+		if src_dir != output_dir and not src_dir.startswith(output_dir + os.sep):
+			self.set_status(400)
+			self.write(message(400, 'Directory must be within the output directory'))
+			return
+
+		if not os.path.isdir(src_dir):
+			self.set_status(404)
+			self.write(message(404, 'Output directory of workflow \"%s\" was not found' % id))
+			return
+
+		# stream tar archive of the selected files
+		content_type, extension = self.FORMATS[format]
+		arcname = os.path.relpath(src_dir, os.path.dirname(output_dir))
+
+		self.set_status(200)
+		self.set_header('content-type', content_type)
+		self.set_header('content-disposition', 'attachment; filename=\"%s-output.%s\"' % (id, extension))
+
+		if not include_body:
+			return
+
+		archiver = self.settings['archiver']
+		blocks = archiver.stream(src_dir, arcname, pattern)
+		loop = tornado.ioloop.IOLoop.current()
+		read = loop.run_in_executor(None, next, blocks, None)
+		pending = collections.deque()
+
+		try:
+			while read != None or pending:
+				# take the next block once it has been read, while sending
+				# earlier blocks and compressing the next ones in parallel
+				if read != None and (not pending or (read.done() and len(pending) < self.PREFETCH)):
+					block = await read
+
+					if block == None:
+						read = None
+						continue
+
+					read = loop.run_in_executor(None, next, blocks, None)
+
+					if format == 'tgz':
+						pending.append(loop.run_in_executor(None, archiver.compress, block))
+					else:
+						pending.append(block)
+
+					continue
+
+				data = pending.popleft()
+
+				if format == 'tgz':
+					data = await data
+
+				self.write(data)
+				await self.flush()
+		except tornado.iostream.StreamClosedError:
+			pass
+
+	def check_if_range(self, id):
+		# send the whole file instead of a range if the file has
+		# changed since the client's copy was downloaded
+		if_range = self.request.headers.get('If-Range')
+
+		if if_range == None or 'Range' not in self.request.headers:
+			return
+
+		try:
+			st = os.stat(self.get_absolute_path(self.root, self.parse_url_path(id)))
+		except OSError:
+			return
+
+		if if_range not in [self.file_etag(st), tornado.httputil.format_timestamp(int(st.st_mtime))]:
+			del self.request.headers['Range']
+
+	def file_etag(self, st):
+		return '\"%x-%x-%x\"' % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+	def compute_etag(self):
+		# streamed archives are generated on every request
+		if self.get_query_argument('format', None) != None:
+			return None
+
+		# derive etag from the file identity, size and modification
+		# time instead of hashing the contents of the whole file
+		return self.file_etag(self._stat())
+
+	@classmethod
+	def get_content(cls, abspath, start=None, end=None):
+		# read the requested range in large blocks
+		with open(abspath, 'rb', buffering=0) as f:
+			offset = start if start != None else 0
+			end = end if end != None else os.fstat(f.fileno()).st_size
+
+			if end - offset > cls.READ_SIZE and hasattr(os, 'posix_fadvise'):
+				os.posix_fadvise(f.fileno(), offset, end - offset, os.POSIX_FADV_SEQUENTIAL)
+
+			while offset < end:
+				chunk = os.pread(f.fileno(), min(cls.READ_SIZE, end - offset), offset)
+
+				if not chunk:
+					break
+
+				offset += len(chunk)
+				yield chunk
+
 	def parse_url_path(self, id):
 		# provide output file if path is specified, otherwise output data archive
 		filename_default = '%s-output.tar.gz' % id
@@ -400,9 +936,25 @@ class TaskQueryHandler(tornado.web.RequestHandler):
 	async def get(self):
 		page = int(self.get_query_argument('page', 0))
 		page_size = int(self.get_query_argument('page_size', 100))
+		after = self.get_query_argument('after', None)
 
 		db = self.settings['db']
-		tasks = await db.task_query(page, page_size)
+
+		# use cursor pagination if cursor is specified
+		if after != None:
+			try:
+				after = decode_cursor(after, str)
+			except ValueError:
+				self.set_status(400)
+				self.write(message(400, 'Invalid cursor'))
+				return
+
+			tasks = await db.task_query(0, page_size, after)
+			tasks = page_response(tasks, page_size, 'utcTime')
+
+		# otherwise use offset pagination
+		else:
+			tasks = await db.task_query(page, page_size)
 
 		self.set_status(200)
 		self.set_header('content-type', 'application/json')
@@ -410,6 +962,8 @@ class TaskQueryHandler(tornado.web.RequestHandler):
 
 	async def post(self):
 		db = self.settings['db']
+		task_queue = self.settings['task_queue']
+		event_hub = self.settings['event_hub']
 
 		# make sure request body is valid
 		try:
@@ -423,30 +977,27 @@ class TaskQueryHandler(tornado.web.RequestHandler):
 			# append id to task
 			task['_id'] = str(bson.ObjectId())
 
-			# extract input features for task
-			if task['event'] == 'process_completed':
-				# load execution log
-				filenames = ['.command.log', '.command.out', '.command.err']
-				filenames = [os.path.join(task['trace']['workdir'], filename) for filename in filenames]
-				files = [open(filename) for filename in filenames if os.path.exists(filename)]
-				lines = [line.strip() for f in files for line in f]
-
-				# parse input features from trace directives
-				PREFIX = '#TRACE'
-				lines = [line[len(PREFIX):] for line in lines if line.startswith(PREFIX)]
-				items = [line.split('=') for line in lines]
-				conditions = {k.strip(): v.strip() for k, v in items}
+			# save task, input features are extracted from
+			# trace directives before the task is saved
+			task_queue.put(task)
 
-				# append input features to task trace
-				task['trace'] = {**task['trace'], **conditions}
+			# publish task event to workflow subscribers
+			run_name = task['runName'].split('-')
+			workflow_id = run_name[1] if len(run_name) > 1 else None
 
-			# save task
-			await db.task_create(task)
+			event_hub.publish(workflow_id, 'task', {
+				'_id': task['_id'],
+				'event': task['event'],
+				'utcTime': task['utcTime'],
+				'trace': task.get('trace')
+			})
 
 			# update workflow status on completed event
 			if task['event'] == 'completed':
+				# make sure that all tasks of the workflow are saved
+				await task_queue.flush(task['runId'])
+
 				# get workflow
-				workflow_id = task['runName'].split('-')[1]
 				workflow = await db.workflow_get(workflow_id)
 
 				# update workflow status
@@ -457,6 +1008,7 @@ class TaskQueryHandler(tornado.web.RequestHandler):
 					workflow['status'] = 'failed'
 
 				await db.workflow_update(workflow['_id'], workflow)
+				event_hub.publish_status(workflow)
 
 			self.set_status(200)
 			self.set_header('content-type', 'application/json')
@@ -469,32 +1021,37 @@ class TaskQueryHandler(tornado.web.RequestHandler):
 
 class TaskLogHandler(tornado.web.RequestHandler):
 
+	MAX_BYTES = 1024 ** 2
+
 	async def get(self, id):
 		db = self.settings['db']
 
 		try:
-			# get workflow
+			# get task
 			task = await db.task_get(id)
 			workdir = task['trace']['workdir']
 
 			# construct response data
 			data = {
-				'_id': id,
-				'out': '',
-				'err': ''
+				'_id': id
 			}
 
-			# append log files if they exist
-			out_file = os.path.join(workdir, '.command.out')
-			err_file = os.path.join(workdir, '.command.err')
+			# append the end of each log file if it exists, the
+			# full log files are available from the stream endpoint
+			for name in ['out', 'err']:
+				log_file = os.path.join(workdir, '.command.%s' % (name))
+
+				try:
+					size = os.path.getsize(log_file)
+				except FileNotFoundError:
+					size = 0
 
-			if os.path.exists(out_file):
-				f = open(out_file)
-				data['out'] = ''.join(f.readlines())
+				start = max(0, size - self.MAX_BYTES)
+				log, _, _ = events.read_log(log_file, start, size)
 
-			if os.path.exists(err_file):
-				f = open(err_file)
-				data['err'] = ''.join(f.readlines())
+				data[name] = log
+				data['%s_size' % (name)] = size
+				data['%s_truncated' % (name)] = (start > 0)
 
 			self.set_status(200)
 			self.set_header('content-type', 'application/json')
@@ -505,14 +1062,134 @@ class TaskLogHandler(tornado.web.RequestHandler):
 
 
 
+class TaskLogStreamHandler(tornado.web.RequestHandler):
+
+	CHUNK_SIZE = 64 * 1024
+
+	def get_byte_range(self, size):
+		# select bytes by range header, head, or tail
+		range_header = self.request.headers.get('Range')
+		head = self.get_query_argument('head', None)
+		tail = self.get_query_argument('tail', None)
+
+		if range_header != None:
+			m = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+
+			if m == None or m.group(1) == m.group(2) == '':
+				raise ValueError('invalid range')
+
+			if m.group(1) == '':
+				start, end = max(0, size - int(m.group(2))), size
+			else:
+				start = int(m.group(1))
+				end = min(size, int(m.group(2)) + 1) if m.group(2) != '' else size
+
+		elif head != None:
+			start, end = 0, min(size, int(head))
+
+		elif tail != None:
+			start, end = max(0, size - int(tail)), size
+
+		else:
+			start, end = 0, size
+
+		return start, end
+
+	async def get(self, id, name):
+		db = self.settings['db']
+		max_bytes = self.settings['task_log_max_bytes']
+
+		try:
+			# get task
+			task = await db.task_get(id)
+			log_file = os.path.join(task['trace']['workdir'], '.command.%s' % (name))
+			f = open(log_file, 'rb')
+		except:
+			self.set_status(404)
+			self.write(message(404, 'Failed to fetch log for task \"%s\"' % id))
+			return
+
+		with f:
+			size = os.fstat(f.fileno()).st_size
+
+			# determine byte range to send
+			try:
+				start, end = self.get_byte_range(size)
+			except ValueError:
+				self.set_status(400)
+				self.write(message(400, 'Invalid byte range'))
+				return
+
+			# an empty log has no satisfiable range, but an empty
+			# log without a range header is sent as an empty body
+			if start >= end and (size > 0 or 'Range' in self.request.headers):
+				self.set_status(416)
+				self.set_header('content-range', 'bytes */%d' % (size))
+				return
+
+			# limit the response to the server-side size cap
+			truncated = (end - start > max_bytes)
+			end = min(end, start + max_bytes)
+
+			if 'Range' in self.request.headers:
+				self.set_status(206)
+				self.set_header('content-range', 'bytes %d-%d/%d' % (start, end - 1, size))
+			else:
+				self.set_status(200)
+
+			self.set_header('content-type', 'text/plain; charset=utf-8')
+			self.set_header('x-log-size', str(size))
+			self.set_header('x-log-truncated', 'true' if truncated else 'false')
+
+			# stream log file in chunks
+			f.seek(start)
+			remaining = end - start
+
+			try:
+				while remaining > 0:
+					chunk = f.read(min(self.CHUNK_SIZE, remaining))
+
+					if not chunk:
+						break
+
+					remaining -= len(chunk)
+					self.write(chunk)
+					await self.flush()
+			except tornado.iostream.StreamClosedError:
+				pass
+
+
+
+class TaskIngestMetricsHandler(tornado.web.RequestHandler):
+
+	async def get(self):
+		task_queue = self.settings['task_queue']
+
+		# report trace directive scan metrics of this server process
+		metrics = dict(task_queue.metrics)
+
+		if metrics['tasks_scanned'] > 0:
+			metrics['mean_bytes_scanned'] = metrics['bytes_scanned'] / metrics['tasks_scanned']
+		else:
+			metrics['mean_bytes_scanned'] = 0
+
+		self.set_status(200)
+		self.set_header('content-type', 'application/json')
+		self.write(tornado.escape.json_encode(metrics))
+
+
+
 class TaskQueryPipelinesHandler(tornado.web.RequestHandler):
 
 	async def get(self):
 		db = self.settings['db']
 
 		try:
-			# query pipelines from database
-			pipelines = await db.task_query_pipelines()
+			# query pipeline catalog from database
+			if self.get_query_argument('detail', 'false') == 'true':
+				pipelines = await db.pipeline_query()
+			else:
+				pipelines = await db.task_query_pipelines()
 
 			self.set_status(200)
 			self.set_header('content-type', 'application/json')
@@ -526,67 +1203,112 @@ class TaskQueryPipelinesHandler(tornado.web.RequestHandler):
 
 class TaskQueryPipelineHandler(tornado.web.RequestHandler):
 
+	# number of traces to write between flushes
+	CHUNK_SIZE = 1000
+
 	async def get(self, pipeline):
 		db = self.settings['db']
+		pipeline = pipeline.lower()
+		format = self.get_query_argument('format', 'json')
+		processes = self.get_query_arguments('process') or None
 
-		try:
-			# query tasks from database
-			pipeline = pipeline.lower()
-			tasks = await db.task_query_pipeline(pipeline)
-			tasks = [task['trace'] for task in tasks]
+		if format not in ['json', 'ndjson']:
+			self.set_status(400)
+			self.write(message(400, 'Invalid format'))
+			return
 
-			# separate tasks into dataframes by process
-			process_names = list(set([task['process'] for task in tasks]))
-			dfs = {}
+		self.streaming = False
 
-			for process in process_names:
-				dfs[process] = [task for task in tasks if task['process'] == process]
+		try:
+			# stream traces one per line as they are read from the database
+			if format == 'ndjson':
+				await self.write_ndjson(db, pipeline, processes)
 
-			self.set_status(200)
-			self.set_header('content-type', 'application/json')
-			self.write(tornado.escape.json_encode(dfs))
+			# otherwise stream traces as a json object of traces by process
+			else:
+				await self.write_json(db, pipeline, processes)
+		except tornado.iostream.StreamClosedError:
+			pass
 		except Exception as e:
-			self.set_status(404)
-			self.write(message(404, 'Failed to perform query'))
+			# the status can only be changed if nothing has been sent yet
+			if not self.streaming:
+				self.clear()
+				self.set_status(404)
+				self.write(message(404, 'Failed to perform query'))
+
 			raise e
 
+	async def write_ndjson(self, db, pipeline, processes):
+		self.set_status(200)
+		self.set_header('content-type', 'application/x-ndjson')
+
+		n_traces = 0
+
+		async for task in db.task_query_pipeline(pipeline, processes):
+			self.write(json.dumps(task['trace']))
+			self.write('\n')
+			n_traces += 1
+
+			if n_traces % self.CHUNK_SIZE == 0:
+				self.streaming = True
+				await self.flush()
+
+	async def write_json(self, db, pipeline, processes):
+		self.set_status(200)
+		self.set_header('content-type', 'application/json')
+
+		# traces are read in order of process, so each process is
+		# written as a complete array without holding its traces
+		self.write('{')
+
+		process = None
+		n_traces = 0
+
+		async for task in db.task_query_pipeline(pipeline, processes, by_process=True):
+			trace = task['trace']
+
+			if n_traces == 0:
+				self.write('%s: [' % (json.dumps(trace['process'])))
+			elif trace['process'] != process:
+				self.write('], %s: [' % (json.dumps(trace['process'])))
+			else:
+				self.write(', ')
+
+			self.write(json.dumps(trace))
+			process = trace['process']
+			n_traces += 1
+
+			if n_traces % self.CHUNK_SIZE == 0:
+				self.streaming = True
+				await self.flush()
+
+		self.write(']}' if n_traces > 0 else '}')
+
 
 
 class TaskArchiveHandler(tornado.web.RequestHandler):
 
 	async def get(self, pipeline):
 		db = self.settings['db']
+		trace_store = self.settings['trace_store']
 
 		try:
-			# query tasks from database
+			# load task dataframes by process from trace store
 			pipeline = pipeline.lower()
-			tasks = await db.task_query_pipeline(pipeline)
-			tasks = [task['trace'] for task in tasks]
-
-			# separate tasks into dataframes by process
-			process_names = list(set([task['process'] for task in tasks]))
-			dfs = {}
-
-			for process in process_names:
-				dfs[process] = pd.DataFrame([task for task in tasks if task['process'] == process])
-
-			# change to trace directory
-			os.chdir(env.TRACE_DIR)
+			dfs = await trace_store.load(db, pipeline)
+			process_names = list(dfs.keys())
 
 			# save dataframes to csv files
 			for process in process_names:
-				filename = 'trace.%s.txt' % (process)
+				filename = os.path.join(env.TRACE_DIR, 'trace.%s.txt' % (process))
 				dfs[process].to_csv(filename, sep='\t', index=False)
 
 			# create zip archive of trace files
 			zipfile = 'trace.%s.zip' % (pipeline.replace('/', '__'))
 			files = ['trace.%s.txt' % (process) for process in process_names]
 
-			subprocess.run(['zip', zipfile] + files, check=True)
-			subprocess.run(['rm', '-f'] + files, check=True)
-
-			# return to working directory
-			os.chdir('..')
+			subprocess.run(['zip', zipfile] + files, cwd=env.TRACE_DIR, check=True)
+			subprocess.run(['rm', '-f'] + files, cwd=env.TRACE_DIR, check=True)
 
 			self.set_status(200)
 			self.write(message(200, 'Archive was created'))
@@ -612,23 +1334,23 @@ class TaskVisualizeHandler(tornado.web.RequestHandler):
 
 	async def post(self):
 		db = self.settings['db']
+		trace_store = self.settings['trace_store']
 
 		try:
 			# parse request body
 			data = tornado.escape.json_decode(self.request.body)
 
-			# query task dataset from database
-			pipeline = data['pipeline'].lower()
-			tasks = await db.task_query_pipeline(pipeline)
-			tasks = [task['trace'] for task in tasks]
-			tasks_process = [task for task in tasks if task['process'] == data['process']]
-
-			df = pd.DataFrame(tasks_process)
-
 			# prepare visualizer args
 			args = data['args']
 			args['plot_name'] = str(bson.ObjectId())
 
+			# load task dataset from trace store
+			pipeline = data['pipeline'].lower()
+			processes = [p for p in [data['process'], args.get('merge_process')] if p != None]
+			dfs = await trace_store.load(db, pipeline, processes)
+
+			df = dfs.get(data['process'], pd.DataFrame())
+
 			if args['selectors'] == '':
 				args['selectors'] = []
 			else:
@@ -637,8 +1359,7 @@ class TaskVisualizeHandler(tornado.web.RequestHandler):
 			# append columns from merge process if specified
 			if 'merge_process' in args:
 				# load merge data
-				tasks_merge = [task for task in tasks if task['process'] == args['merge_process']]
-				df_merge = pd.DataFrame(tasks_merge)
+				df_merge = dfs.get(args['merge_process'], pd.DataFrame())
 
 				# remove duplicate columns
 				dupe_columns = set(df.columns).intersection(df_merge.columns)
@@ -686,18 +1407,12 @@ class ModelTrainHandler(tornado.web.RequestHandler):
 
 	async def post(self):
 		db = self.settings['db']
+		trace_store = self.settings['trace_store']
 
 		try:
 			# parse request body
 			data = tornado.escape.json_decode(self.request.body)
-
-			# query task dataset from database
 			pipeline = data['pipeline'].lower()
-			tasks = await db.task_query_pipeline(pipeline)
-			tasks = [task['trace'] for task in tasks]
-			tasks_process = [task for task in tasks if task['process'] == data['process']]
-
-			df = pd.DataFrame(tasks_process)
 
 			# prepare training args
 			args = data['args']
@@ -709,11 +1424,16 @@ class ModelTrainHandler(tornado.web.RequestHandler):
 			else:
 				args['selectors'] = args['selectors'].split(' ')
 
+			# load task dataset from trace store
+			processes = [p for p in [data['process'], args['merge_process']] if p != None]
+			dfs = await trace_store.load(db, pipeline, processes)
+
+			df = dfs.get(data['process'], pd.DataFrame())
+
 			# append columns from merge process if specified
 			if args['merge_process'] != None:
 				# load merge data
-				tasks_merge = [task for task in tasks if task['process'] == args['merge_process']]
-				df_merge = pd.DataFrame(tasks_merge)
+				df_merge = dfs.get(args['merge_process'], pd.DataFrame())
 
 				# remove duplicate columns
 				dupe_columns = set(df.columns).intersection(df_merge.columns)
@@ -804,9 +1524,30 @@ class ModelPredictHandler(tornado.web.RequestHandler):
 
 if __name__ == '__main__':
 	# parse command-line options
-	tornado.options.define('backend', default='mongo', help='Database backend to use (file or mongo)')
+	tornado.options.define('backend', default='mongo', help='Database backend to use (file, sqlite or mongo)')
 	tornado.options.define('url-file', default='db.pkl', help='database file for file backend')
+	tornado.options.define('url-sqlite', default='db.sqlite', help='database file for sqlite backend')
 	tornado.options.define('url-mongo', default='localhost', help='mongodb service url for mongo backend')
+	tornado.options.define('debug-queries', default=False, help='warn about database queries which do not use an index')
+	tornado.options.define('rebuild-catalog', default=False, help='rebuild the pipeline catalog from all task events at startup')
+	tornado.options.define('ingest-batch-size', default=100, help='number of task events to save in a single batch')
+	tornado.options.define('ingest-flush-interval', default=1.0, help='maximum number of seconds to hold task events before saving them')
+	tornado.options.define('ingest-max-retries', default=5, help='number of times to retry saving a task event, with exponential backoff, before it is dropped')
+	tornado.options.define('ingest-workers', default=4, help='number of threads used to read trace directives from task work directories')
+	tornado.options.define('trace-sources', default=['.command.log', '.command.out', '.command.err'], multiple=True, help='task log files to scan for trace directives')
+	tornado.options.define('trace-max-bytes', default=1024 ** 2, help='maximum number of bytes to scan for trace directives in each task log file')
+	tornado.options.define('events-interval', default=1.0, help='number of seconds between checks for workflow status and log updates')
+	tornado.options.define('task-log-max-bytes', default=64 * 1024 ** 2, help='maximum number of bytes to send from a task log file')
+	tornado.options.define('max-buffer-size', default=64 * 1024 ** 2, help='maximum size of a request body which is buffered in memory')
+	tornado.options.define('upload-max-bytes', default=1024 ** 4, help='maximum size of an input file upload, which is streamed to disk')
+	tornado.options.define('upload-session-max-age', default=24 * 3600, help='number of seconds after which an inactive upload session is removed')
+	tornado.options.define('upload-cleanup-interval', default=3600, help='number of seconds between checks for inactive upload sessions')
+	tornado.options.define('launch-slots', default=['%s:%d' % (k, v) for k, v in launchqueue.DEFAULT_SLOTS.items()], multiple=True, help='maximum number of running workflows for each executor, as <executor>:<slots>')
+	tornado.options.define('launch-max-load', default=1.0 if env.NXF_EXECUTOR == 'local' else 0.0, help='maximum 1-minute load average per cpu at which another workflow is launched (0 to disable, disabled by default unless the executor is local)')
+	tornado.options.define('launch-min-memory', default=2 * 1024 ** 3 if env.NXF_EXECUTOR == 'local' else 0, help='minimum available memory in bytes at which another workflow is launched (0 to disable, disabled by default unless the executor is local)')
+	tornado.options.define('launch-interval', default=5.0, help='number of seconds between checks of the launch queue')
+	tornado.options.define('archive-workers', default=os.cpu_count(), help='number of threads used to compress output data archives')
+	tornado.options.define('archive-level', default=6, help='gzip compression level of output data archives')
 	tornado.options.define('np', default=1, help='number of server processes')
 	tornado.options.define('port', default=8080)
 	tornado.options.parse_command_line()
@@ -821,14 +1562,22 @@ if __name__ == '__main__':
 		(r'/api/workflows', WorkflowQueryHandler),
 		(r'/api/workflows/0', WorkflowCreateHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)', WorkflowEditHandler),
+		(r'/api/workflows/([a-zA-Z0-9-]+)/files', WorkflowFilesHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)/upload', WorkflowUploadHandler),
+		(r'/api/workflows/([a-zA-Z0-9-]+)/uploads', WorkflowUploadSessionsHandler),
+		(r'/api/workflows/([a-zA-Z0-9-]+)/uploads/([a-f0-9]+)', WorkflowUploadSessionHandler),
+		(r'/api/workflows/([a-zA-Z0-9-]+)/uploads/([a-f0-9]+)/([0-9]+)', WorkflowUploadChunkHandler),
+		(r'/api/workflows/([a-zA-Z0-9-]+)/uploads/([a-f0-9]+)/finalize', WorkflowUploadFinalizeHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)/launch', WorkflowLaunchHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)/resume', WorkflowResumeHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)/cancel', WorkflowCancelHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)/log', WorkflowLogHandler),
+		(r'/api/workflows/([a-zA-Z0-9-]+)/events', WorkflowEventsHandler),
 		(r'/api/workflows/([a-zA-Z0-9-]+)/download', WorkflowDownloadHandler, dict(path=env.WORKFLOWS_DIR)),
 		(r'/api/tasks', TaskQueryHandler),
 		(r'/api/tasks/([a-zA-Z0-9-]+)/log', TaskLogHandler),
+		(r'/api/tasks/([a-zA-Z0-9-]+)/log/(out|err)', TaskLogStreamHandler),
+		(r'/api/tasks/ingest', TaskIngestMetricsHandler),
 		(r'/api/tasks/pipelines', TaskQueryPipelinesHandler),
 		(r'/api/tasks/pipelines/(.+)', TaskQueryPipelineHandler),
 		(r'/api/tasks/archive/(.+)/download', TaskArchiveDownloadHandler, dict(path=env.TRACE_DIR)),
@@ -843,7 +1592,7 @@ if __name__ == '__main__':
 
 	try:
 		# spawn server processes
-		server = tornado.httpserver.HTTPServer(app, max_buffer_size=1024 ** 3)
+		server = tornado.httpserver.HTTPServer(app, max_buffer_size=tornado.options.options.max_buffer_size)
 		server.bind(tornado.options.options.port)
 		server.start(tornado.options.options.np)
 
@@ -851,15 +1600,79 @@ if __name__ == '__main__':
 		if tornado.options.options.backend == 'file':
 			app.settings['db'] = backend.FileBackend(tornado.options.options.url_file)
 
+		elif tornado.options.options.backend == 'sqlite':
+			app.settings['db'] = backend.SQLiteBackend(tornado.options.options.url_sqlite)
+
 		elif tornado.options.options.backend == 'mongo':
-			app.settings['db'] = backend.MongoBackend(tornado.options.options.url_mongo)
+			app.settings['db'] = backend.MongoBackend(tornado.options.options.url_mongo, debug=tornado.options.options.debug_queries)
 
 		else:
-			raise KeyError('Backend must be either \'json\' or \'mongo\'')
+			raise KeyError('Backend must be either \'file\', \'sqlite\' or \'mongo\'')
+
+		# prepare database backend
+		tornado.ioloop.IOLoop.current().run_sync(app.settings['db'].prepare)
+
+		if tornado.options.options.rebuild_catalog:
+			tornado.ioloop.IOLoop.current().run_sync(app.settings['db'].pipeline_rebuild)
+
+		# set size limit of input file uploads
+		app.settings['upload_max_bytes'] = tornado.options.options.upload_max_bytes
+
+		# set size cap of task log responses
+		app.settings['task_log_max_bytes'] = tornado.options.options.task_log_max_bytes
+
+		# initialize directory listing cache
+		app.settings['listing_cache'] = listing.ListingCache()
+
+		# initialize workflow event hub
+		app.settings['event_hub'] = events.EventHub(app.settings['db'], interval=tornado.options.options.events_interval)
+
+		# initialize output data archiver
+		app.settings['archiver'] = archive.Archiver(
+			max_workers=tornado.options.options.archive_workers,
+			level=tornado.options.options.archive_level)
+
+		# initialize launch queue, which is run by the first server process
+		app.settings['launch_queue'] = launchqueue.LaunchQueue(
+			app.settings['db'],
+			app.settings['event_hub'],
+			slots=launchqueue.parse_slots(tornado.options.options.launch_slots)[env.NXF_EXECUTOR],
+			max_load=tornado.options.options.launch_max_load,
+			min_memory=tornado.options.options.launch_min_memory,
+			interval=tornado.options.options.launch_interval,
+			archiver=app.settings['archiver'])
+
+		if tornado.process.task_id() in [None, 0]:
+			app.settings['launch_queue'].start()
+
+			# remove inactive upload sessions periodically
+			max_age = tornado.options.options.upload_session_max_age
+			cleanup = lambda: tornado.ioloop.IOLoop.current().run_in_executor(None, cleanup_upload_sessions, max_age)
+
+			tornado.ioloop.PeriodicCallback(cleanup, tornado.options.options.upload_cleanup_interval * 1000).start()
+
+		# initialize trace store
+		app.settings['trace_store'] = tracestore.TraceStore(os.path.join(env.TRACE_DIR, 'store'))
+
+		# initialize task ingestion queue
+		app.settings['task_queue'] = ingest.TaskQueue(
+			app.settings['db'],
+			trace_store=app.settings['trace_store'],
+			trace_scanner=ingest.TraceScanner(
+				sources=tornado.options.options.trace_sources,
+				max_bytes=tornado.options.options.trace_max_bytes),
+			batch_size=tornado.options.options.ingest_batch_size,
+			flush_interval=tornado.options.options.ingest_flush_interval,
+			max_retries=tornado.options.options.ingest_max_retries,
+			max_workers=tornado.options.options.ingest_workers)
 
 		# start the event loop
 		print('The API is listening on http://0.0.0.0:%d' % (tornado.options.options.port), flush=True)
 		tornado.ioloop.IOLoop.current().start()
 
 	except KeyboardInterrupt:
+		# save any queued task events before exiting
+		if 'task_queue' in app.settings:
+			tornado.ioloop.IOLoop.current().run_sync(app.settings['task_queue'].flush)
+
 		tornado.ioloop.IOLoop.current().stop()
@@ -0,0 +1,363 @@
+import asyncio
+import bson
+import fcntl
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import shutil
+
+import backend
+
+
+
+# store of task traces in arrow files by pipeline and process, a pipeline
+# is built from the database when it is first loaded, traces appended
+# while it is rebuilt are recorded and replayed once the rebuild is done
+class TraceStore():
+
+	# merge the parts of a partition once there are more than this many
+	MAX_PARTS = 16
+
+	def __init__(self, path):
+		# use an absolute path since the working directory may change
+		self._path = os.path.abspath(path)
+		self._run_pipelines = {}
+		self._unknown_runs = set()
+
+		os.makedirs(self._path, exist_ok=True)
+
+		# the lock serializes appends with the start and end of rebuilds
+		# across processes, the generation is incremented by every rebuild
+		# so that an append can tell whether a pipeline was rebuilt after
+		# its tasks were saved
+		self._lock = backend.FileLock(os.path.join(self._path, '.lock'))
+		self._generation = backend.Generation(os.path.join(self._path, '.generation'))
+
+	def pipeline_dir(self, pipeline):
+		return os.path.join(self._path, pipeline.replace('/', '__'))
+
+	def pending_dir(self, pipeline):
+		return '%s.pending' % (self.pipeline_dir(pipeline))
+
+	def process_dir(self, pipeline, process):
+		return os.path.join(self.pipeline_dir(pipeline), process.replace('/', '__'))
+
+	def generation(self):
+		return self._generation.get()[0]
+
+	def completed_generation(self, pipeline):
+		# generation of the rebuild which completed a pipeline, or None
+		try:
+			with open(os.path.join(self.pipeline_dir(pipeline), '.complete')) as f:
+				return int(f.read() or 0)
+		except FileNotFoundError:
+			return None
+
+	def is_complete(self, pipeline):
+		return os.path.exists(os.path.join(self.pipeline_dir(pipeline), '.complete'))
+
+	def write_part(self, process_dir, df):
+		# store columns with mixed types as strings
+		for column in df.columns:
+			if df[column].dtype == object:
+				types = set(type(v) for v in df[column] if not pd.isna(v))
+
+				if len(types) > 1:
+					df[column] = df[column].map(lambda v: str(v) if not pd.isna(v) else None)
+
+		# convert dataframe to arrow table
+		table = pa.Table.from_pandas(df, preserve_index=False)
+
+		# write table to a new part file
+		os.makedirs(process_dir, exist_ok=True)
+
+		filename = os.path.join(process_dir, '%s.arrow' % (bson.ObjectId()))
+		tmp_filename = '%s.tmp' % (filename)
+
+		with pa.OSFile(tmp_filename, 'wb') as sink:
+			with pa.ipc.new_file(sink, table.schema) as writer:
+				writer.write_table(table)
+
+		os.replace(tmp_filename, filename)
+
+	def read_parts(self, process_dir, columns=None):
+		try:
+			filenames = sorted(f for f in os.listdir(process_dir) if f.endswith('.arrow'))
+		except FileNotFoundError:
+			return pd.DataFrame()
+
+		# read parts as memory-mapped tables, selecting only the given columns
+		dfs = []
+
+		for filename in filenames:
+			with pa.memory_map(os.path.join(process_dir, filename), 'r') as source:
+				table = pa.ipc.open_file(source).read_all()
+
+			if columns != None:
+				table = table.select([c for c in columns if c in table.column_names])
+
+			dfs.append(table.to_pandas())
+
+		if not dfs:
+			return pd.DataFrame()
+
+		df = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+
+		# merge parts into a single part if there are too many
+		if columns == None and len(filenames) > self.MAX_PARTS:
+			self.merge_parts(process_dir, filenames, df)
+
+		return df
+
+	def merge_parts(self, process_dir, filenames, df):
+		with open(os.path.join(process_dir, '.lock'), 'w') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+
+			# skip merge if another process has already merged these parts
+			if not all(os.path.exists(os.path.join(process_dir, f)) for f in filenames):
+				return
+
+			self.write_part(process_dir, df.copy())
+
+			for filename in filenames:
+				os.remove(os.path.join(process_dir, filename))
+
+	async def append(self, db, tasks, generation=None):
+		# group completed tasks by pipeline, the generation is the store
+		# generation from before the tasks were saved to the database
+		pipeline_tasks = {}
+
+		for task in tasks:
+			if task['event'] == 'started':
+				self.set_run_pipeline(task['runId'], task['metadata']['workflow']['projectName'])
+
+		# look up runs whose started event was not known before
+		for run_id in list(self._unknown_runs):
+			pipeline = await db.pipeline_of_run(run_id)
+
+			if pipeline != None:
+				self.set_run_pipeline(run_id, pipeline)
+
+		for task in tasks:
+			if task['event'] == 'process_completed':
+				run_id = task['runId']
+
+				if run_id not in self._run_pipelines and run_id not in self._unknown_runs:
+					pipeline = await db.pipeline_of_run(run_id)
+
+					if pipeline != None:
+						self._run_pipelines[run_id] = pipeline
+
+				pipeline = self._run_pipelines.get(run_id)
+
+				# remember traces of runs whose pipeline is not known yet,
+				# so that the pipeline is rebuilt once it becomes known
+				if pipeline == None:
+					self._unknown_runs.add(run_id)
+				else:
+					pipeline_tasks.setdefault(pipeline, []).append(task)
+
+		# write traces of each pipeline
+		loop = asyncio.get_event_loop()
+
+		for pipeline, tasks in pipeline_tasks.items():
+			try:
+				await loop.run_in_executor(None, self.write_tasks, pipeline, tasks, generation)
+
+			# mark pipeline as incomplete so that it is rebuilt on the next load
+			except Exception as e:
+				print('warning: failed to append traces to %s: %s' % (pipeline, e), flush=True)
+				self.invalidate(pipeline)
+
+	def write_tasks(self, pipeline, tasks, generation):
+		with self._lock:
+			pending_dir = self.pending_dir(pipeline)
+
+			# record traces for the rebuild in progress, which skips
+			# the tasks that were already returned by its query
+			if os.path.exists(pending_dir):
+				filename = os.path.join(pending_dir, '%s.json' % (bson.ObjectId()))
+
+				with open(filename, 'w') as f:
+					json.dump([{ '_id': task['_id'], 'trace': task['trace'] } for task in tasks], f)
+
+				return
+
+			# skip pipelines which have not been loaded yet, they
+			# will be built from the database when they are loaded
+			completed = self.completed_generation(pipeline)
+
+			if completed == None:
+				return
+
+			# the pipeline was rebuilt after the tasks were saved, so it
+			# may already contain them
+			if generation != None and completed > generation:
+				self._invalidate(pipeline)
+				return
+
+			# write a new part for each process
+			traces = {}
+
+			for task in tasks:
+				traces.setdefault(task['trace']['process'], []).append(task['trace'])
+
+			for process, process_traces in traces.items():
+				self.write_part(self.process_dir(pipeline, process), pd.DataFrame(process_traces))
+
+	def set_run_pipeline(self, run_id, pipeline):
+		self._run_pipelines[run_id] = pipeline
+
+		# traces of the run were skipped while its pipeline was unknown
+		if run_id in self._unknown_runs:
+			self._unknown_runs.remove(run_id)
+			self.invalidate(pipeline)
+
+	def invalidate(self, pipeline):
+		with self._lock:
+			self._invalidate(pipeline)
+
+	def _invalidate(self, pipeline):
+		try:
+			os.remove(os.path.join(self.pipeline_dir(pipeline), '.complete'))
+		except FileNotFoundError:
+			pass
+
+		# keep a rebuild in progress from marking the pipeline as complete
+		if os.path.exists(self.pending_dir(pipeline)):
+			open(os.path.join(self.pending_dir(pipeline), '.invalid'), 'w').close()
+
+	def start_rebuild(self, pipeline):
+		with self._lock:
+			pending_dir = self.pending_dir(pipeline)
+
+			# mark the previous directory as incomplete in case this rebuild does
+			# not finish, and remove traces recorded by a previous rebuild
+			self._invalidate(pipeline)
+
+			shutil.rmtree(pending_dir, ignore_errors=True)
+			os.makedirs(pending_dir)
+
+	def finish_rebuild(self, pipeline, rebuild_dir, task_ids):
+		with self._lock:
+			pipeline_dir = self.pipeline_dir(pipeline)
+			pending_dir = self.pending_dir(pipeline)
+
+			# replay traces which were appended during the rebuild
+			# and were not returned by its query
+			traces = {}
+
+			for filename in sorted(os.listdir(pending_dir)):
+				if not filename.endswith('.json'):
+					continue
+
+				with open(os.path.join(pending_dir, filename)) as f:
+					for task in json.load(f):
+						if task['_id'] not in task_ids:
+							task_ids.add(task['_id'])
+							traces.setdefault(task['trace']['process'], []).append(task['trace'])
+
+			for process, process_traces in traces.items():
+				self.write_part(os.path.join(rebuild_dir, process.replace('/', '__')), pd.DataFrame(process_traces))
+
+			# mark pipeline as complete unless it was invalidated in the meantime
+			os.makedirs(rebuild_dir, exist_ok=True)
+
+			if not os.path.exists(os.path.join(pending_dir, '.invalid')):
+				generation, _ = self._generation.increment()
+
+				with open(os.path.join(rebuild_dir, '.complete'), 'w') as f:
+					f.write(str(generation))
+
+			# replace the previous directory and stop recording traces
+			old_dir = '%s.%s.old' % (pipeline_dir, bson.ObjectId())
+
+			try:
+				os.rename(pipeline_dir, old_dir)
+			except FileNotFoundError:
+				pass
+
+			os.rename(rebuild_dir, pipeline_dir)
+			shutil.rmtree(pending_dir)
+
+		shutil.rmtree(old_dir, ignore_errors=True)
+
+	def abort_rebuild(self, pipeline, rebuild_dir):
+		with self._lock:
+			shutil.rmtree(self.pending_dir(pipeline), ignore_errors=True)
+
+		shutil.rmtree(rebuild_dir, ignore_errors=True)
+
+	async def rebuild(self, db, pipeline):
+		rebuild_dir = '%s.%s.tmp' % (self.pipeline_dir(pipeline), bson.ObjectId())
+		loop = asyncio.get_event_loop()
+
+		await loop.run_in_executor(None, self.start_rebuild, pipeline)
+
+		try:
+			# write traces from database to a new directory in batches
+			traces = {}
+			task_ids = set()
+			n_traces = 0
+
+			async for task in db.task_query_pipeline(pipeline):
+				trace = task['trace']
+				traces.setdefault(trace['process'], []).append(trace)
+				task_ids.add(task['_id'])
+				n_traces += 1
+
+				if n_traces >= 100000:
+					for process, process_traces in traces.items():
+						await loop.run_in_executor(None, self.write_part, os.path.join(rebuild_dir, process.replace('/', '__')), pd.DataFrame(process_traces))
+
+					traces = {}
+					n_traces = 0
+
+			for process, process_traces in traces.items():
+				await loop.run_in_executor(None, self.write_part, os.path.join(rebuild_dir, process.replace('/', '__')), pd.DataFrame(process_traces))
+
+			await loop.run_in_executor(None, self.finish_rebuild, pipeline, rebuild_dir, task_ids)
+		except:
+			await loop.run_in_executor(None, self.abort_rebuild, pipeline, rebuild_dir)
+			raise
+
+	async def acquire_rebuild(self, pipeline):
+		# only one request in any process rebuilds a pipeline at a time,
+		# the lock is released if the process dies during a rebuild
+		f = open('%s.rebuild' % (self.pipeline_dir(pipeline)), 'a')
+
+		while True:
+			try:
+				fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				return f
+			except BlockingIOError:
+				await asyncio.sleep(0.5)
+			except:
+				f.close()
+				raise
+
+	async def load(self, db, pipeline, processes=None, columns=None):
+		# build pipeline from the database if it hasn't been loaded before
+		if not self.is_complete(pipeline):
+			with await self.acquire_rebuild(pipeline):
+				if not self.is_complete(pipeline):
+					await self.rebuild(db, pipeline)
+
+		# load dataframe of each process
+		if processes == None:
+			try:
+				processes = [p for p in os.listdir(self.pipeline_dir(pipeline)) if not p.startswith('.')]
+			except FileNotFoundError:
+				processes = []
+
+		loop = asyncio.get_event_loop()
+		dfs = {}
+
+		for process in processes:
+			df = await loop.run_in_executor(None, self.read_parts, self.process_dir(pipeline, process), columns)
+
+			if not df.empty:
+				dfs[process] = df
+
+		return dfs
@@ -0,0 +1,341 @@
+import bson
+import email.message
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+
+
+
+# incremental parser for multipart/form-data request bodies, which
+# writes each file part directly to a file in a staging directory and
+# moves it to the output directory once it is complete, the staging
+# directory must be on the same filesystem as the output directory
+class MultipartParser():
+
+	MAX_HEADER_SIZE = 64 * 1024
+
+	def __init__(self, boundary, output_dir, staging_dir):
+		self._delimiter = b'\r\n--' + boundary
+		self._output_dir = output_dir
+		self._staging_dir = staging_dir
+		self._state = 'preamble'
+
+		# prepend a line break so that the first boundary
+		# can be found in the same way as the others
+		self._buffer = bytearray(b'\r\n')
+		self._file = None
+		self._filename = None
+		self._tmp_filename = None
+		self.filenames = []
+
+	def feed(self, data):
+		self._buffer += data
+
+		while self.step():
+			pass
+
+	def step(self):
+		# search for the next boundary
+		if self._state in ['preamble', 'body']:
+			idx = self._buffer.find(self._delimiter)
+
+			# write as much data as possible while keeping any partial boundary
+			if idx == -1:
+				n = max(0, len(self._buffer) - len(self._delimiter) + 1)
+
+				if self._state == 'body':
+					self._file.write(self._buffer[:n])
+
+				del self._buffer[:n]
+				return False
+
+			if self._state == 'body':
+				self._file.write(self._buffer[:idx])
+				self.close_part()
+
+			del self._buffer[:idx + len(self._delimiter)]
+			self._state = 'boundary'
+			return True
+
+		# determine whether the boundary is followed by another part
+		if self._state == 'boundary':
+			if len(self._buffer) < 2:
+				return False
+
+			if self._buffer[:2] == b'--':
+				self._state = 'epilogue'
+			elif self._buffer[:2] == b'\r\n':
+				self._state = 'headers'
+			else:
+				raise ValueError('invalid multipart boundary')
+
+			del self._buffer[:2]
+			return True
+
+		# parse the headers of the next part
+		if self._state == 'headers':
+			idx = self._buffer.find(b'\r\n\r\n')
+
+			if idx == -1:
+				if len(self._buffer) > self.MAX_HEADER_SIZE:
+					raise ValueError('multipart headers are too large')
+
+				return False
+
+			headers = self._buffer[:idx].decode('utf-8')
+			del self._buffer[:idx + 4]
+
+			self.open_part(headers)
+			self._state = 'body'
+			return True
+
+		# ignore anything after the last boundary
+		if self._state == 'epilogue':
+			self._buffer.clear()
+			return False
+
+	def open_part(self, headers):
+		msg = email.message.Message()
+
+		for line in headers.split('\r\n'):
+			if ':' in line:
+				key, value = line.split(':', 1)
+				msg[key.strip()] = value.strip()
+
+		# write file parts to a temporary file, discard other fields
+		filename = msg.get_param('filename', header='content-disposition')
+
+		if filename:
+			self._filename = os.path.basename(filename)
+			self._tmp_filename = os.path.join(self._staging_dir, '%s.%s.upload' % (self._filename, bson.ObjectId()))
+			self._file = open(self._tmp_filename, 'wb')
+		else:
+			self._file = open(os.devnull, 'wb')
+
+	def close_part(self):
+		self._file.close()
+		self._file = None
+
+		# move completed file into place
+		if self._tmp_filename != None:
+			os.replace(self._tmp_filename, os.path.join(self._output_dir, self._filename))
+			self.filenames.append(self._filename)
+
+		self._filename = None
+		self._tmp_filename = None
+
+	def finish(self):
+		if self._state != 'epilogue':
+			self.abort()
+			raise ValueError('multipart body is incomplete')
+
+	def abort(self):
+		# remove any partially written file
+		if self._file != None:
+			self._file.close()
+			self._file = None
+
+		if self._tmp_filename != None:
+			os.remove(self._tmp_filename)
+			self._tmp_filename = None
+
+
+
+# resumable upload of a single file in numbered chunks, the session
+# state is kept on disk so that chunks can be sent to any server process
+class UploadSession():
+
+	def __init__(self, sessions_dir, id):
+		self.id = id
+		self._dir = os.path.join(sessions_dir, id)
+
+		with open(os.path.join(self._dir, 'session.json')) as f:
+			self.data = json.load(f)
+
+	@classmethod
+	def create(cls, sessions_dir, output_dir, filename, size, chunk_size, sha256=None, max_size=None):
+		id = str(bson.ObjectId())
+		filename = os.path.basename(filename)
+
+		if not filename or size < 0 or chunk_size <= 0:
+			raise ValueError('invalid upload session')
+
+		if max_size != None and size > max_size:
+			raise ValueError('file is larger than %d bytes' % (max_size))
+
+		data = {
+			'_id': id,
+			'filename': filename,
+			'size': size,
+			'chunk_size': chunk_size,
+			'n_chunks': max(1, math.ceil(size / chunk_size)),
+			'sha256': sha256,
+			'output_dir': output_dir,
+			'tmp_filename': os.path.join(sessions_dir, id, 'data')
+		}
+
+		# initialize session directory and the output file, which
+		# grows as chunks are written at their offsets
+		os.makedirs(os.path.join(sessions_dir, id, 'chunks'))
+		os.makedirs(output_dir, exist_ok=True)
+
+		open(data['tmp_filename'], 'wb').close()
+
+		with open(os.path.join(sessions_dir, id, 'session.json'), 'w') as f:
+			json.dump(data, f)
+
+		return cls(sessions_dir, id)
+
+	def chunk_range(self, index):
+		if not 0 <= index < self.data['n_chunks']:
+			raise ValueError('invalid chunk index')
+
+		start = index * self.data['chunk_size']
+		end = min(start + self.data['chunk_size'], self.data['size'])
+
+		return start, end
+
+	def open_chunk(self, index):
+		# open the output file for writing a chunk at its offset
+		start, end = self.chunk_range(index)
+		fd = os.open(self.data['tmp_filename'], os.O_WRONLY)
+
+		return ChunkWriter(fd, start, end)
+
+	def mark_chunk(self, index):
+		open(os.path.join(self._dir, 'chunks', str(index)), 'w').close()
+
+	def last_modified(self):
+		# time of the last change to the session or its output file
+		paths = [os.path.join(self._dir, 'session.json'), os.path.join(self._dir, 'chunks'), self.data['tmp_filename']]
+		mtimes = []
+
+		for path in paths:
+			try:
+				mtimes.append(os.stat(path).st_mtime)
+			except FileNotFoundError:
+				pass
+
+		return max(mtimes)
+
+	def received(self):
+		return sorted(int(c) for c in os.listdir(os.path.join(self._dir, 'chunks')))
+
+	def status(self):
+		# merge received chunks into byte ranges
+		received = self.received()
+		ranges = []
+
+		for index in received:
+			start, end = self.chunk_range(index)
+
+			if ranges and ranges[-1][1] == start:
+				ranges[-1][1] = end
+			else:
+				ranges.append([start, end])
+
+		return {
+			'_id': self.id,
+			'filename': self.data['filename'],
+			'size': self.data['size'],
+			'chunk_size': self.data['chunk_size'],
+			'n_chunks': self.data['n_chunks'],
+			'received': ranges,
+			'missing': sorted(set(range(self.data['n_chunks'])) - set(received))
+		}
+
+	def finalize(self, sha256=None):
+		# make sure that all chunks were received
+		if len(self.received()) != self.data['n_chunks']:
+			raise ValueError('upload is missing chunks')
+
+		# verify checksum of the assembled file
+		sha256 = sha256 or self.data['sha256']
+
+		if sha256:
+			h = hashlib.sha256()
+
+			with open(self.data['tmp_filename'], 'rb') as f:
+				for block in iter(lambda: f.read(1024 ** 2), b''):
+					h.update(block)
+
+			if h.hexdigest() != sha256.lower():
+				raise ValueError('checksum mismatch (expected %s, received %s)' % (sha256, h.hexdigest()))
+
+		# move file into place and remove session
+		filename = os.path.join(self.data['output_dir'], self.data['filename'])
+		os.replace(self.data['tmp_filename'], filename)
+		shutil.rmtree(self._dir)
+
+		return self.data['filename']
+
+	def abort(self):
+		try:
+			os.remove(self.data['tmp_filename'])
+		except FileNotFoundError:
+			pass
+
+		shutil.rmtree(self._dir, ignore_errors=True)
+
+
+
+def cleanup_sessions(sessions_dir, max_age):
+	# remove upload sessions and staged files of multipart uploads
+	# which have not changed in max_age seconds
+	try:
+		names = os.listdir(sessions_dir)
+	except FileNotFoundError:
+		return
+
+	now = time.time()
+
+	for name in names:
+		try:
+			if name == 'staging':
+				staging_dir = os.path.join(sessions_dir, name)
+
+				for filename in os.listdir(staging_dir):
+					path = os.path.join(staging_dir, filename)
+
+					if now - os.stat(path).st_mtime > max_age:
+						os.remove(path)
+			else:
+				session = UploadSession(sessions_dir, name)
+
+				if now - session.last_modified() > max_age:
+					session.abort()
+
+		# skip sessions which were finalized or removed in the meantime
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError) as e:
+			print('warning: failed to clean up upload session %s: %s' % (name, e), flush=True)
+
+
+
+class ChunkWriter():
+
+	def __init__(self, fd, start, end):
+		self._fd = fd
+		self._offset = start
+		self._end = end
+
+	def write(self, data):
+		if self._offset + len(data) > self._end:
+			raise ValueError('chunk is too large')
+
+		data = memoryview(data)
+
+		while data:
+			n = os.pwrite(self._fd, data, self._offset)
+			data = data[n:]
+			self._offset += n
+
+	def close(self):
+		os.close(self._fd)
+
+		# return whether the whole chunk was written
+		return self._offset == self._end
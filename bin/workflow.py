@@ -3,7 +3,6 @@
 import asyncio
 import os
 import signal
-import subprocess
 
 import env
 
@@ -14,13 +13,15 @@ def get_run_name(workflow):
 
 
 
-def run_workflow(workflow, work_dir, resume):
-	# save current directory
-	prev_dir = os.getcwd()
+# number of seconds between progress updates of the output archive
+ARCHIVE_PROGRESS_INTERVAL = 5.0
 
-	# change to workflow directory
-	os.chdir(work_dir)
+# keep references to running launch tasks so that they are not garbage collected
+_launch_tasks = set()
 
+
+
+async def run_workflow(workflow, work_dir, resume):
 	# prepare command line arguments
 	run_name = get_run_name(workflow)
 
@@ -67,9 +68,9 @@ def run_workflow(workflow, work_dir, resume):
 	# add params file if specified
 	if workflow['params_format'] and workflow['params_data']:
 		params_filename = 'params.%s' % (workflow['params_format'])
-		params_file = open(params_filename, 'w')
-		params_file.write(workflow['params_data'])
-		params_file.close()
+
+		with open(os.path.join(work_dir, params_filename), 'w') as f:
+			f.write(workflow['params_data'])
 
 		args += ['-params-file', params_filename]
 
@@ -77,42 +78,78 @@ def run_workflow(workflow, work_dir, resume):
 	if resume:
 		args += ['-resume']
 
-	# launch workflow asynchronously
-	proc = subprocess.Popen(
-		args,
-		stdout=open('.workflow.log', 'w'),
-		stderr=subprocess.STDOUT
-	)
-
-	# return to original directory
-	os.chdir(prev_dir)
+	# launch workflow asynchronously in the workflow directory
+	with open(os.path.join(work_dir, '.workflow.log'), 'w') as log_file:
+		proc = await asyncio.create_subprocess_exec(
+			*args,
+			cwd=work_dir,
+			stdout=log_file,
+			stderr=asyncio.subprocess.STDOUT
+		)
 
 	return proc
 
 
 
-def save_output(workflow, output_dir):
-	return subprocess.Popen(
-		['scripts/kube-save.sh', workflow['_id'], output_dir],
-		stdout=subprocess.PIPE,
-		stderr=subprocess.STDOUT
-	)
+async def save_output(db, workflow, archiver):
+	# collect output data and workflow log into a single archive
+	work_dir = os.path.join(env.WORKFLOWS_DIR, workflow['_id'])
+	output_dir = os.path.join(work_dir, workflow['output_dir'])
+	arcname = os.path.basename(os.path.normpath(workflow['output_dir']))
+
+	progress = { 'status': 'running' }
+
+	loop = asyncio.get_event_loop()
+	future = loop.run_in_executor(
+		None,
+		archiver.create,
+		output_dir,
+		os.path.join(work_dir, '%s-output.tar.gz' % (workflow['_id'])),
+		arcname,
+		[(os.path.join(arcname, 'workflow.log'), os.path.join(work_dir, '.workflow.log'))],
+		progress.update)
+
+	# report progress on the workflow until the archive is complete
+	while True:
+		done, _ = await asyncio.wait([future], timeout=ARCHIVE_PROGRESS_INTERVAL)
+
+		if done:
+			break
+
+		await set_property(db, workflow, 'output_archive', dict(progress))
+
+	try:
+		progress.update(future.result())
+		progress['status'] = 'completed'
+	except Exception as e:
+		progress['status'] = 'failed'
+		progress['error'] = str(e)
+
+	await set_property(db, workflow, 'output_archive', progress)
+
+	return progress['status'] == 'completed'
 
 
 
 async def set_property(db, workflow, key, value):
+	# only write the given field, since the workflow may have been
+	# changed since it was launched (e.g. cancelled or relaunched)
 	workflow[key] = value
-	await db.workflow_update(workflow['_id'], workflow)
-
+	await db.workflow_update_fields(workflow['_id'], { key: value })
 
 
-async def launch_async(db, workflow, resume):
-	# re-initialize database backend
-	db.initialize()
 
+async def launch_async(db, workflow, resume, archiver, on_exit=None):
 	# start workflow
 	work_dir = os.path.join(env.WORKFLOWS_DIR, workflow['_id'])
-	proc = run_workflow(workflow, work_dir, resume)
+
+	try:
+		proc = await run_workflow(workflow, work_dir, resume)
+	except OSError as e:
+		print('%s: failed to start workflow: %s' % (workflow['_id'], e))
+		await set_property(db, workflow, 'status', 'failed')
+		return
+
 	proc_pid = proc.pid
 
 	print('%d: saving workflow pid...' % (proc_pid))
@@ -123,7 +160,12 @@ async def launch_async(db, workflow, resume):
 	print('%d: waiting for workflow to finish...' % (proc_pid))
 
 	# wait for workflow to complete
-	if proc.wait() == 0:
+	returncode = await proc.wait()
+
+	if on_exit != None:
+		on_exit()
+
+	if returncode == 0:
 		print('%d: workflow completed' % (proc_pid))
 		await set_property(db, workflow, 'status', 'completed')
 	else:
@@ -134,25 +176,25 @@ async def launch_async(db, workflow, resume):
 	print('%d: saving output data...' % (proc_pid))
 
 	# save output data
-	output_dir = os.path.join(env.WORKFLOWS_DIR, workflow['_id'], workflow['output_dir'])
-	proc = save_output(workflow, output_dir)
-
-	proc_out, _ = proc.communicate()
-	print(proc_out.decode('utf-8'))
-
-	if proc.wait() == 0:
+	if await save_output(db, workflow, archiver):
 		print('%d: save output data completed' % (proc_pid))
 	else:
-		print('%d: save output data failed' % (proc_pid))
+		print('%d: save output data failed: %s' % (proc_pid, workflow['output_archive']['error']))
+
 
 
+def launch(db, workflow, resume, archiver, on_exit=None):
+	# run workflow in the background on the current event loop,
+	# on_exit is called once nextflow exits, before the output is saved
+	task = asyncio.ensure_future(launch_async(db, workflow, resume, archiver, on_exit))
+	task.add_done_callback(_launch_tasks.discard)
+	_launch_tasks.add(task)
 
-def launch(db, workflow, resume):
-	asyncio.run(launch_async(db, workflow, resume))
+	return task
 
 
 
-def cancel(workflow):
+async def cancel(workflow):
 	# terminate child process
 	if workflow['pid'] != -1:
 		try:
@@ -162,10 +204,10 @@ def cancel(workflow):
 
 	# delete pods if relevant
 	if env.NXF_EXECUTOR == 'k8s':
-		proc = subprocess.Popen(
-			['scripts/kube-cancel.sh', get_run_name(workflow)],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.STDOUT
+		proc = await asyncio.create_subprocess_exec(
+			'scripts/kube-cancel.sh', get_run_name(workflow),
+			stdout=asyncio.subprocess.PIPE,
+			stderr=asyncio.subprocess.STDOUT
 		)
-		proc_out, _ = proc.communicate()
+		proc_out, _ = await proc.communicate()
 		print(proc_out.decode('utf-8'))
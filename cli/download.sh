@@ -2,15 +2,23 @@
 # Download output data for a workflow instance on a nextflow server.
 
 # parse command-line arguments
-if [[ $# != 2 ]]; then
-	echo "usage: $0 <url> <id>"
+if [[ $# != 2 && $# != 3 ]]; then
+	echo "usage: $0 <url> <id> [tar|tgz]"
 	exit -1
 fi
 
 URL="$1"
 ID="$2"
+FORMAT="$3"
 
-# download output data for a workflow instance
-curl -s -o "${ID}-output.tar.gz" ${URL}/api/workflows/${ID}/download
+# download output data for a workflow instance, either the saved
+# archive or an archive which is streamed from the output directory
+if [[ -z ${FORMAT} ]]; then
+	curl -s -o "${ID}-output.tar.gz" ${URL}/api/workflows/${ID}/download
+elif [[ ${FORMAT} == "tar" ]]; then
+	curl -s -o "${ID}-output.tar" "${URL}/api/workflows/${ID}/download?format=tar"
+else
+	curl -s -o "${ID}-output.tar.gz" "${URL}/api/workflows/${ID}/download?format=tgz"
+fi
 
 echo
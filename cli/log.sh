@@ -2,13 +2,20 @@
 # Get the log of a workflow instance on a nextflow server.
 
 # parse command-line arguments
-if [[ $# != 2 ]]; then
-	echo "usage: $0 <url> <id>"
+if [[ $# != 2 && !($# == 3 && $3 == "--follow") ]]; then
+	echo "usage: $0 <url> <id> [--follow]"
 	exit -1
 fi
 
 URL="$1"
 ID="$2"
+FOLLOW="$3"
+
+# stream status and log events of a workflow instance
+if [[ ${FOLLOW} == "--follow" ]]; then
+	curl -s -N -X GET ${URL}/api/workflows/${ID}/events
+	exit
+fi
 
 # get the log of a workflow instance
 curl -s -X GET ${URL}/api/workflows/${ID}/log
@@ -0,0 +1,84 @@
+#!/bin/bash
+# Upload a large input file for a workflow instance on a nextflow server
+# in parallel chunks. Re-run the same command to resume an interrupted upload.
+
+# parse command-line arguments
+if [[ $# < 3 || $# > 5 ]]; then
+	echo "usage: $0 <url> <id> <filename> [jobs] [chunk-size]"
+	exit -1
+fi
+
+URL="$1"
+ID="$2"
+FILENAME="$3"
+JOBS="${4:-4}"
+CHUNK_SIZE="${5:-8388608}"
+
+SIZE=$(stat -c %s "${FILENAME}")
+SESSION_FILE="${FILENAME}.upload-session"
+
+# extract a field from a json response
+json_field() {
+	python3 -c "import json, sys; v = json.load(sys.stdin)['$1']; print(' '.join(map(str, v)) if isinstance(v, list) else v)"
+}
+
+# resume previous upload session if it still exists
+if [[ -f ${SESSION_FILE} ]]; then
+	SESSION=$(cat ${SESSION_FILE})
+	STATUS=$(curl -s -f ${URL}/api/workflows/${ID}/uploads/${SESSION})
+
+	if [[ $? != 0 ]]; then
+		SESSION=""
+	fi
+fi
+
+# otherwise create a new upload session
+if [[ -z ${SESSION} ]]; then
+	STATUS=$(curl -s -f \
+		-X POST \
+		-d "{\"filename\":\"$(basename ${FILENAME})\",\"size\":${SIZE},\"chunk_size\":${CHUNK_SIZE}}" \
+		${URL}/api/workflows/${ID}/uploads)
+
+	if [[ $? != 0 ]]; then
+		echo "error: failed to create upload session"
+		exit -1
+	fi
+
+	SESSION=$(echo ${STATUS} | json_field _id)
+	echo ${SESSION} > ${SESSION_FILE}
+fi
+
+# upload missing chunks in parallel
+CHUNK_SIZE=$(echo ${STATUS} | json_field chunk_size)
+MISSING=$(echo ${STATUS} | json_field missing)
+
+echo "uploading ${FILENAME} ($(echo ${MISSING} | wc -w) chunks remaining)"
+
+upload_chunk() {
+	tail -c +$(($1 * CHUNK_SIZE + 1)) "${FILENAME}" \
+		| head -c ${CHUNK_SIZE} \
+		| curl -s -f -X PUT --data-binary @- ${URL}/api/workflows/${ID}/uploads/${SESSION}/$1 > /dev/null \
+		|| echo "error: failed to upload chunk $1"
+}
+
+export -f upload_chunk
+export URL ID FILENAME SESSION CHUNK_SIZE
+
+echo ${MISSING} | tr ' ' '\n' | grep -v '^$' | xargs -P ${JOBS} -I {} bash -c 'upload_chunk {}'
+
+# verify checksum and finalize upload
+SHA256=$(sha256sum "${FILENAME}" | cut -d ' ' -f 1)
+
+RESULT=$(curl -s \
+	-X POST \
+	-d "{\"sha256\":\"${SHA256}\"}" \
+	${URL}/api/workflows/${ID}/uploads/${SESSION}/finalize)
+
+echo ${RESULT}
+
+if ! echo ${RESULT} | grep -q '"status": 200'; then
+	echo "error: upload is incomplete, re-run to resume"
+	exit -1
+fi
+
+rm -f ${SESSION_FILE}
@@ -112,8 +112,8 @@ app.service('api', ['$http', '$q', function($http, $q) {
 
 	this.Workflow = {}
 
-	this.Workflow.query = function(page) {
-		return httpRequest('get', 'api/workflows', { page: page })
+	this.Workflow.query = function(after) {
+		return httpRequest('get', 'api/workflows', { after: after })
 	}
 
 	this.Workflow.get = function(id) {
@@ -136,8 +136,16 @@ app.service('api', ['$http', '$q', function($http, $q) {
 		return httpRequest('post', `api/workflows/${id}/cancel`)
 	}
 
-	this.Workflow.log = function(id) {
-		return httpRequest('get', `api/workflows/${id}/log`)
+	this.Workflow.log = function(id, offset) {
+		return httpRequest('get', `api/workflows/${id}/log`, { offset: offset })
+	}
+
+	this.Workflow.files = function(id, dir, page) {
+		return httpRequest('get', `api/workflows/${id}/files`, { dir: dir, page: page })
+	}
+
+	this.Workflow.events = function(id) {
+		return new EventSource(window.location.pathname + `api/workflows/${id}/events`)
 	}
 
 	this.Workflow.remove = function(id) {
@@ -146,16 +154,16 @@ app.service('api', ['$http', '$q', function($http, $q) {
 
 	this.Task = {}
 
-	this.Task.query = function(page) {
-		return httpRequest('get', 'api/tasks', { page: page })
+	this.Task.query = function(after) {
+		return httpRequest('get', 'api/tasks', { after: after })
 	}
 
-	this.Task.query_pipelines = function() {
-		return httpRequest('get', `api/tasks/pipelines`)
+	this.Task.query_pipelines = function(detail) {
+		return httpRequest('get', `api/tasks/pipelines`, { detail: detail })
 	}
 
-	this.Task.query_pipeline = function(pipeline) {
-		return httpRequest('get', `api/tasks/pipelines/${pipeline}`)
+	this.Task.query_pipeline = function(pipeline, process) {
+		return httpRequest('get', `api/tasks/pipelines/${pipeline}`, { process: process })
 	}
 
 	this.Task.archive = function(pipeline) {
@@ -216,6 +224,7 @@ app.controller('MainCtrl', ['$scope', 'alert', function($scope, alert) {
 
 const STATUS_COLORS = {
 	'nascent': 'primary',
+	'queued': 'info',
 	'running': 'warning',
 	'completed': 'success',
 	'failed': 'danger'
@@ -226,13 +235,15 @@ const STATUS_COLORS = {
 app.controller('WorkflowsCtrl', ['$scope', '$route', 'alert', 'api', function($scope, $route, alert, api) {
 	$scope.STATUS_COLORS = STATUS_COLORS
 	$scope.page = 0
+	$scope.cursors = ['']
 	$scope.workflows = []
 
 	$scope.query = function(page) {
-		api.Workflow.query(page)
-			.then(function(workflows) {
+		api.Workflow.query($scope.cursors[page])
+			.then(function(res) {
 				$scope.page = page
-				$scope.workflows = workflows
+				$scope.cursors[page + 1] = res.next
+				$scope.workflows = res.items
 			}, function() {
 				alert.error('Failed to query workflow instances.')
 			})
@@ -258,9 +269,17 @@ app.controller('WorkflowsCtrl', ['$scope', '$route', 'alert', 'api', function($s
 
 
 
-app.controller('WorkflowCtrl', ['$scope', '$interval', '$route', 'alert', 'api', 'FileUploader', function($scope, $interval, $route, alert, api, FileUploader) {
+app.controller('WorkflowCtrl', ['$scope', '$route', 'alert', 'api', 'FileUploader', function($scope, $route, alert, api, FileUploader) {
 	$scope.STATUS_COLORS = STATUS_COLORS
 	$scope.workflow = {}
+	$scope.files = {
+		input: { page: 0, items: [], total: 0 },
+		output: { page: 0, items: [], total: 0 }
+	}
+
+	$scope.isActive = function(workflow) {
+		return workflow.status === 'queued' || workflow.status === 'running'
+	}
 
 	$scope.uploader = new FileUploader({
 		 url: `${window.location.pathname}api/workflows/${$route.current.params.id}/upload`
@@ -297,7 +316,7 @@ app.controller('WorkflowCtrl', ['$scope', '$interval', '$route', 'alert', 'api',
 
 		api.Workflow.launch(id)
 			.then(function() {
-				alert.success('Workflow instance launched.')
+				alert.success('Workflow instance queued for launch.')
 				$scope.workflow.status = ''
 				$scope.workflow.log = ''
 				$scope.launching = false
@@ -313,7 +332,7 @@ app.controller('WorkflowCtrl', ['$scope', '$interval', '$route', 'alert', 'api',
 
 		api.Workflow.resume(id)
 			.then(function() {
-				alert.success('Workflow instance resumed.')
+				alert.success('Workflow instance queued for resume.')
 				$scope.workflow.status = ''
 				$scope.workflow.log = ''
 				$scope.resuming = false
@@ -338,27 +357,56 @@ app.controller('WorkflowCtrl', ['$scope', '$interval', '$route', 'alert', 'api',
 			})
 	}
 
+	$scope.fetchFiles = function(dir, page) {
+		api.Workflow.files($scope.workflow._id, dir, page)
+			.then(function(res) {
+				$scope.files[dir] = { page: page, items: res.items, total: res.total }
+			}, function() {
+				alert.error('Failed to list workflow files.')
+			})
+	}
+
 	$scope.fetchLog = function() {
-		if ( $scope.intervalPromise ) {
-			return
+		if ( $scope.eventSource ) {
+			$scope.eventSource.close()
 		}
 
-		$scope.intervalPromise = $interval(function() {
-			api.Workflow.log($scope.workflow._id)
-				.then(function(res) {
-					Object.assign($scope.workflow, res)
+		// subscribe to status and log updates of the workflow
+		$scope.eventSource = api.Workflow.events($scope.workflow._id)
 
-					if ( res.status !== 'running' ) {
-						$interval.cancel($scope.intervalPromise)
-						$scope.intervalPromise = undefined
-					}
-				})
-		}, 2000, -1)
+		$scope.eventSource.addEventListener('log', function(e) {
+			let res = JSON.parse(e.data)
+
+			// append new log output, or replace the log if it was restarted
+			$scope.$apply(function() {
+				if ( res.start === 0 ) {
+					$scope.workflow.log = res.log
+				}
+				else {
+					$scope.workflow.log += res.log
+				}
+			})
+		})
+
+		$scope.eventSource.addEventListener('status', function(e) {
+			let res = JSON.parse(e.data)
+
+			$scope.$apply(function() {
+				$scope.workflow.status = res.status
+				$scope.workflow.attempts = res.attempts
+			})
+
+			if ( res.status !== 'queued' && res.status !== 'running' ) {
+				$scope.eventSource.close()
+				$scope.eventSource = undefined
+				$scope.fetchFiles('output', 0)
+			}
+		})
 	}
 
 	$scope.$on('$destroy', function() {
-		if ( angular.isDefined($scope.intervalPromise) ) {
-			$interval.cancel($scope.intervalPromise)
+		if ( angular.isDefined($scope.eventSource) ) {
+			$scope.eventSource.close()
 		}
 	})
 
@@ -368,6 +416,8 @@ app.controller('WorkflowCtrl', ['$scope', '$interval', '$route', 'alert', 'api',
 			$scope.workflow = workflow
 
 			if ( $scope.workflow._id !== '0' ) {
+				$scope.fetchFiles('input', 0)
+				$scope.fetchFiles('output', 0)
 				$scope.fetchLog()
 			}
 		}, function() {
@@ -379,6 +429,7 @@ app.controller('WorkflowCtrl', ['$scope', '$interval', '$route', 'alert', 'api',
 
 app.controller('TasksCtrl', ['$scope', 'alert', 'api', function($scope, alert, api) {
 	$scope.page = 0
+	$scope.cursors = ['']
 	$scope.tasks = []
 
 	$scope.query_pipelines = function() {
@@ -391,10 +442,11 @@ app.controller('TasksCtrl', ['$scope', 'alert', 'api', function($scope, alert, a
 	}
 
 	$scope.query_tasks = function(page) {
-		api.Task.query(page)
-			.then(function(tasks) {
+		api.Task.query($scope.cursors[page])
+			.then(function(res) {
 				$scope.page = page
-				$scope.tasks = tasks
+				$scope.cursors[page + 1] = res.next
+				$scope.tasks = res.items
 			}, function() {
 				alert.error('Failed to query tasks.')
 			})
@@ -428,12 +480,14 @@ app.controller('TaskCtrl', ['$scope', '$route', 'alert', 'api', function($scope,
 	$scope.task = {}
 	$scope.task_out = ''
 	$scope.task_err = ''
+	$scope.task_log = {}
 
 	$scope.fetchLog = function() {
 		api.Task.log($route.current.params.id)
 			.then(function(res) {
 				$scope.task_out = res.out
 				$scope.task_err = res.err
+				$scope.task_log = res
 			}, function() {
 				alert.error('Failed to fetch task logs.')
 			})
@@ -450,7 +504,7 @@ app.controller('TaskCtrl', ['$scope', '$route', 'alert', 'api', function($scope,
 
 
 
-app.controller('VisualizerCtrl', ['$scope', 'alert', 'api', function($scope, alert, api) {
+app.controller('VisualizerCtrl', ['$scope', '$q', 'alert', 'api', function($scope, $q, alert, api) {
 	$scope.args = {
 		selectors: 'exit=0',
 		height: 3,
@@ -471,20 +525,15 @@ app.controller('VisualizerCtrl', ['$scope', 'alert', 'api', function($scope, ale
 	$scope.query_dataset = function(pipeline) {
 		$scope.querying = true
 
-		api.Task.query_pipeline(pipeline)
-			.then(function(data) {
-				let process_names = Object.keys(data)
-				let process_columns = process_names.reduce((prev, process) => {
-					let tasks = data[process]
-					let columns = new Set(tasks.reduce((p, t) => p.concat(Object.keys(t)), []))
-					prev[process] = Array.from(columns)
-					return prev
-				}, {})
+		// get process names from the pipeline catalog
+		api.Task.query_pipelines(true)
+			.then(function(pipelines) {
+				let p = pipelines.find(p => p.pipeline === pipeline.toLowerCase())
 
 				$scope.querying = false
-				$scope.pipeline_data = data
-				$scope.process_names = process_names
-				$scope.process_columns = process_columns
+				$scope.dataset_pipeline = pipeline
+				$scope.process_names = p ? p.processes.sort() : []
+				$scope.process_columns = {}
 			}, function() {
 				$scope.querying = false
 				alert.error('Failed to query pipeline tasks.')
@@ -492,11 +541,25 @@ app.controller('VisualizerCtrl', ['$scope', 'alert', 'api', function($scope, ale
 	}
 
 	$scope.update_columns = function(process_columns, process, merge_process) {
-		let array1 = process ? process_columns[process] : []
-		let array2 = merge_process ? process_columns[merge_process] : []
+		// fetch tasks of selected processes which have not been loaded yet
+		let missing = [process, merge_process].filter(p => p && !process_columns[p])
+		let promises = missing.map(p => api.Task.query_pipeline($scope.dataset_pipeline, p)
+			.then(function(data) {
+				let tasks = data[p] || []
+				let columns = new Set(tasks.reduce((prev, t) => prev.concat(Object.keys(t)), []))
+				process_columns[p] = Array.from(columns)
+			}))
+
+		$q.all(promises)
+			.then(function() {
+				let array1 = process ? process_columns[process] : []
+				let array2 = merge_process ? process_columns[merge_process] : []
 
-		$scope.columns = Array.from(new Set(array1.concat(array2)))
-		$scope.merge_columns = array1.filter(value => array2.includes(value));
+				$scope.columns = Array.from(new Set(array1.concat(array2)))
+				$scope.merge_columns = array1.filter(value => array2.includes(value));
+			}, function() {
+				alert.error('Failed to query pipeline tasks.')
+			})
 	}
 
 	$scope.visualize = function(pipeline, process, args) {
@@ -521,7 +584,7 @@ app.controller('VisualizerCtrl', ['$scope', 'alert', 'api', function($scope, ale
 
 
 
-app.controller('ModelCtrl', ['$scope', 'alert', 'api', function($scope, alert, api) {
+app.controller('ModelCtrl', ['$scope', '$q', 'alert', 'api', function($scope, $q, alert, api) {
 	$scope.args = {
 		merge_process: null,
 		inputs: [],
@@ -549,20 +612,15 @@ app.controller('ModelCtrl', ['$scope', 'alert', 'api', function($scope, alert, a
 	$scope.query_dataset = function(pipeline) {
 		$scope.querying = true
 
-		api.Task.query_pipeline(pipeline)
-			.then(function(data) {
-				let process_names = Object.keys(data)
-				let process_columns = process_names.reduce((prev, process) => {
-					let tasks = data[process]
-					let columns = new Set(tasks.reduce((p, t) => p.concat(Object.keys(t)), []))
-					prev[process] = Array.from(columns)
-					return prev
-				}, {})
+		// get process names from the pipeline catalog
+		api.Task.query_pipelines(true)
+			.then(function(pipelines) {
+				let p = pipelines.find(p => p.pipeline === pipeline.toLowerCase())
 
 				$scope.querying = false
-				$scope.pipeline_data = data
-				$scope.process_names = process_names
-				$scope.process_columns = process_columns
+				$scope.dataset_pipeline = pipeline
+				$scope.process_names = p ? p.processes.sort() : []
+				$scope.process_columns = {}
 			}, function() {
 				$scope.querying = false
 				alert.error('Failed to query pipeline tasks.')
@@ -570,11 +628,25 @@ app.controller('ModelCtrl', ['$scope', 'alert', 'api', function($scope, alert, a
 	}
 
 	$scope.update_columns = function(process_columns, process, merge_process) {
-		let array1 = process ? process_columns[process] : []
-		let array2 = merge_process ? process_columns[merge_process] : []
+		// fetch tasks of selected processes which have not been loaded yet
+		let missing = [process, merge_process].filter(p => p && !process_columns[p])
+		let promises = missing.map(p => api.Task.query_pipeline($scope.dataset_pipeline, p)
+			.then(function(data) {
+				let tasks = data[p] || []
+				let columns = new Set(tasks.reduce((prev, t) => prev.concat(Object.keys(t)), []))
+				process_columns[p] = Array.from(columns)
+			}))
 
-		$scope.columns = Array.from(new Set(array1.concat(array2)))
-		$scope.merge_columns = array1.filter(value => array2.includes(value));
+		$q.all(promises)
+			.then(function() {
+				let array1 = process ? process_columns[process] : []
+				let array2 = merge_process ? process_columns[merge_process] : []
+
+				$scope.columns = Array.from(new Set(array1.concat(array2)))
+				$scope.merge_columns = array1.filter(value => array2.includes(value));
+			}, function() {
+				alert.error('Failed to query pipeline tasks.')
+			})
 	}
 
 	$scope.train = function(pipeline, process, args) {
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tornado.gen
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import server
+
+
+
+class LegacyDownloadHandler(tornado.web.StaticFileHandler):
+
+	# download handler before range and etag changes, for comparison
+	def parse_url_path(self, id):
+		filename = self.get_query_argument('path', '%s-output.tar.gz' % id)
+
+		self.set_header('content-disposition', 'attachment; filename=\"%s\"' % filename)
+		return os.path.join(id, filename)
+
+
+
+def run_server(sock, root):
+	app = tornado.web.Application([
+		(r'/legacy/([a-zA-Z0-9-]+)/download', LegacyDownloadHandler, dict(path=root)),
+		(r'/current/([a-zA-Z0-9-]+)/download', server.WorkflowDownloadHandler, dict(path=root))
+	])
+
+	http_server = tornado.httpserver.HTTPServer(app)
+	http_server.add_sockets([sock])
+	tornado.ioloop.IOLoop.current().start()
+
+
+
+async def fetch(client, url, headers=None):
+	# download a url while discarding the response body,
+	# returns the time to first byte and the number of bytes
+	start = time.time()
+	state = { 'first': None, 'bytes': 0 }
+
+	def on_chunk(chunk):
+		if state['first'] == None:
+			state['first'] = time.time() - start
+
+		state['bytes'] += len(chunk)
+
+	await client.fetch(url, headers=headers, streaming_callback=on_chunk, request_timeout=3600)
+
+	return state['first'], state['bytes']
+
+
+
+async def benchmark(base_url, args):
+	size = args.size * 1024 ** 2
+	client = tornado.httpclient.AsyncHTTPClient(max_clients=args.concurrency, max_body_size=size)
+	url = '%s/bench/download?path=%s' % (base_url, args.filename)
+
+	# time to first byte of the first request
+	first, _ = await fetch(client, url, { 'Range': 'bytes=0-0' })
+
+	# throughput of concurrent full downloads
+	start = time.time()
+	results = await tornado.gen.multi([fetch(client, url) for _ in range(args.concurrency)])
+	elapsed = time.time() - start
+	n_bytes = sum(n for _, n in results)
+
+	# rate of random range requests
+	ranges = []
+
+	for _ in range(args.n_ranges):
+		offset = random.randrange(0, size - args.range_size)
+		ranges.append('bytes=%d-%d' % (offset, offset + args.range_size - 1))
+
+	range_start = time.time()
+	await tornado.gen.multi([fetch(client, url, { 'Range': r }) for r in ranges])
+	range_elapsed = time.time() - range_start
+
+	return {
+		'first_byte': first,
+		'throughput': n_bytes / elapsed / 1024 ** 2,
+		'range_rate': args.n_ranges / range_elapsed
+	}
+
+
+
+def main():
+	# parse command-line arguments
+	parser = argparse.ArgumentParser(description='Compare file download throughput of the current and legacy download handlers')
+	parser.add_argument('--size', help='size of the test file in MB', type=int, default=1024)
+	parser.add_argument('--concurrency', help='number of concurrent downloads', type=int, default=4)
+	parser.add_argument('--n-ranges', help='number of range requests', type=int, default=1000)
+	parser.add_argument('--range-size', help='size of each range request in bytes', type=int, default=64 * 1024)
+	parser.add_argument('--filename', help='name of the test file', default='output/bench.bin')
+
+	args = parser.parse_args()
+
+	# create test file
+	root = tempfile.mkdtemp()
+	filename = os.path.join(root, 'bench', args.filename)
+	os.makedirs(os.path.dirname(filename))
+
+	with open(filename, 'wb') as f:
+		for _ in range(args.size):
+			f.write(os.urandom(1024 ** 2))
+
+	# start server in a separate process
+	sock, = tornado.netutil.bind_sockets(0, '127.0.0.1')
+	proc = multiprocessing.Process(target=run_server, args=(sock, root), daemon=True)
+	proc.start()
+
+	port = sock.getsockname()[1]
+
+	try:
+		print('%-8s %16s %18s %16s' % ('handler', 'first byte (s)', 'throughput (MB/s)', 'ranges (req/s)'))
+
+		for handler in ['legacy', 'current']:
+			base_url = 'http://127.0.0.1:%d/%s' % (port, handler)
+			results = tornado.ioloop.IOLoop.current().run_sync(lambda: benchmark(base_url, args))
+
+			print('%-8s %16.3f %18.1f %16.1f' % (handler, results['first_byte'], results['throughput'], results['range_rate']))
+	finally:
+		proc.terminate()
+		os.remove(filename)
+
+
+
+if __name__ == '__main__':
+	main()